@@ -3,14 +3,25 @@
 from __future__ import print_function
 import os, sys, json
 import subprocess
-from datetime import datetime
-from collections import Iterable
+import shutil
+import base64
+import hashlib
+import pickle
+import time
+import random
+import re
+import gzip
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from collections import defaultdict, namedtuple
+from collections.abc import Iterable
 import pandas as pd
 import numpy as np
 import firecloud.api
 import iso8601
 import argparse
-import multiprocessing as mp
 
 from .__about__ import __version__
 
@@ -26,6 +37,15 @@ def convert_time(x):
     return datetime.timestamp(iso8601.parse_date(x))
 
 
+def parse_timestamps(x):
+    """Convert list-like of ISO 8601 timestamps to pd.Series of UTC datetimes"""
+    x = pd.Series(x)
+    try:
+        return pd.to_datetime(x, utc=True, format='ISO8601')
+    except (ValueError, TypeError):  # pandas<2.0
+        return pd.to_datetime(x, utc=True)
+
+
 def workflow_time(workflow):
     """
     Convert API output to timestamp difference
@@ -37,160 +57,896 @@ def workflow_time(workflow):
 
 
 #------------------------------------------------------------------------------
-#  Wrapper functions for gsutil calls
+#  Helper functions for concurrent API calls
+#------------------------------------------------------------------------------
+
+def call_with_retry(func, *args, max_retries=3, backoff=1, retry_if=None, **kwargs):
+    """
+    Call func(*args, **kwargs), retrying with exponential backoff
+    (randomized by up to 2x) if an exception is raised
+
+    retry_if: optional predicate; exceptions for which it returns False are raised immediately
+    """
+    for attempt in range(max_retries+1):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if attempt==max_retries or (retry_if is not None and not retry_if(e)):
+                raise
+            time.sleep(backoff * 2**attempt * (1 + random.random()))
+
+
+def parallel_map(func, items, num_threads=10, max_retries=0, backoff=1,
+                 retry_if=None, return_exceptions=False, message=None):
+    """
+    Apply func to each element of items using a pool of threads
+
+    Results are returned in the order of items. Each call is retried
+    individually (see call_with_retry). If return_exceptions is True,
+    the exception raised by a failed call is returned in place of its result;
+    otherwise the first failure is raised.
+
+    message: progress message, printed as '<message> k/n'
+    """
+    items = list(items)
+    results = [None]*len(items)
+    if len(items)==0:
+        return results
+    with ThreadPoolExecutor(max_workers=max(1, min(num_threads, len(items)))) as executor:
+        futures = {executor.submit(call_with_retry, func, i, max_retries=max_retries, backoff=backoff,
+                                   retry_if=retry_if):k
+                   for k,i in enumerate(items)}
+        for n,f in enumerate(as_completed(futures)):
+            if message is not None:
+                print('\r{} {}/{}'.format(message, n+1, len(items)), end='')
+            try:
+                results[futures[f]] = f.result()
+            except Exception as e:
+                if not return_exceptions:
+                    for g in futures:
+                        g.cancel()
+                    raise
+                results[futures[f]] = e
+    if message is not None:
+        print()
+    return results
+
+
+#------------------------------------------------------------------------------
+#  Persistent cache for JSON documents
+#------------------------------------------------------------------------------
+
+class JSONCache(object):
+    """
+    On-disk cache of JSON documents, stored as gzip-compressed files.
+    If max_bytes is set, least recently used documents are evicted once
+    the total (compressed) size exceeds max_bytes.
+
+    Keys are strings or tuples of strings (mapped to subdirectories).
+    """
+    def __init__(self, cache_dir, max_bytes=None):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_bytes = max_bytes
+        self._index = None  # path -> [last access time, size]
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        if isinstance(key, str):
+            key = (key,)
+        return os.path.join(self.cache_dir, *[re.sub(r'[^\w.-]', '_', k) for k in key])+'.json.gz'
+
+    def _load_index(self):
+        if self._index is None:
+            self._index = {}
+            for root,_,files in os.walk(self.cache_dir):
+                for f in files:
+                    if f.endswith('.json.gz'):
+                        st = os.stat(os.path.join(root, f))
+                        self._index[os.path.join(root, f)] = [st.st_mtime, st.st_size]
+            self._total_bytes = sum([i[1] for i in self._index.values()])
+
+    def _evict(self):
+        if self.max_bytes is None or self._total_bytes<=self.max_bytes:
+            return
+        for path,(_,size) in sorted(self._index.items(), key=lambda x: x[1][0]):
+            if os.path.exists(path):
+                os.remove(path)
+            self._index.pop(path)
+            self._total_bytes -= size
+            if self._total_bytes<=self.max_bytes:
+                break
+
+    def get(self, key):
+        """Return cached document, or None if not in cache"""
+        path = self._path(key)
+        try:
+            with gzip.open(path, 'rt') as f:
+                value = json.load(f)
+        except (IOError, OSError, ValueError):  # missing or incomplete
+            return None
+        now = time.time()
+        with self._lock:
+            self._load_index()
+            try:
+                os.utime(path, (now, now))
+            except OSError:  # evicted or removed since it was read
+                if path in self._index:
+                    self._total_bytes -= self._index.pop(path)[1]
+                return None
+            if path in self._index:
+                self._index[path][0] = now
+        return value
+
+    def set(self, key, value):
+        """Store document"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with gzip.open(tmp_path, 'wt') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._load_index()
+            if path in self._index:
+                self._total_bytes -= self._index[path][1]
+            self._index[path] = [time.time(), os.path.getsize(path)]
+            self._total_bytes += self._index[path][1]
+            self._evict()
+
+    def remove(self, key):
+        """Remove document from cache"""
+        path = self._path(key)
+        with self._lock:
+            self._load_index()
+            if path in self._index:
+                self._total_bytes -= self._index.pop(path)[1]
+            if os.path.exists(path):
+                os.remove(path)
+
+
+#------------------------------------------------------------------------------
+#  Storage backends
 #------------------------------------------------------------------------------
 
+# record returned by storage listings (md5: hex digest, or None if not available)
+StorageObject = namedtuple('StorageObject', ['path', 'size', 'md5', 'updated'])
+
+
+def split_gs_path(path):
+    """Split gs://bucket/object path into (bucket, object)"""
+    assert path.startswith('gs://'), 'Not a gs:// path: {}'.format(path)
+    bucket, _, name = path[5:].partition('/')
+    return bucket, name
+
+
+class GsutilBackend(object):
+    """Storage operations using gsutil subprocesses"""
+    def __init__(self, gsutil='gsutil'):
+        self.gsutil = gsutil
+
+    def _run(self, args, input_paths=None, check=True):
+        r = subprocess.run([self.gsutil]+args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            input=None if input_paths is None else '\n'.join(input_paths).encode())
+        if check and r.returncode!=0:
+            raise subprocess.CalledProcessError(r.returncode, [self.gsutil]+args, r.stdout, r.stderr)
+        return r
+
+    def iter_files(self, prefix):
+        """Iterate over all files starting with prefix (yields StorageObject)"""
+        args = [self.gsutil, 'ls', '-l', prefix+'**']
+        with tempfile.TemporaryFile() as stderr:
+            p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=stderr)
+            try:
+                for line in p.stdout:
+                    # object names may contain whitespace
+                    i = line.decode().rstrip('\r\n').split(None, 2)
+                    if len(i)==3 and i[2].startswith('gs://'):  # skip summary line
+                        yield StorageObject(i[2], int(i[0]), None, iso8601.parse_date(i[1]))
+            finally:
+                p.stdout.close()
+                p.wait()
+            if p.returncode!=0:
+                stderr.seek(0)
+                err = stderr.read()
+                if b'matched no objects' not in err:
+                    raise subprocess.CalledProcessError(p.returncode, args, None, err)
+
+    def exists(self, path):
+        return self._run(['-q', 'stat', path], check=False).returncode==0
+
+    def cat(self, path, tail_bytes=None):
+        args = ['cat', path] if tail_bytes is None else ['cat', '-r', '-{}'.format(int(tail_bytes)), path]
+        return self._run(args).stdout
+
+    def md5(self, path):
+        s = self._run(['hash', '-m', '-h', path]).stdout.decode().strip().split('\n')
+        return [i for i in s if 'md5' in i][0].split()[-1]
+
+    def du(self, prefix):
+        return np.int64(self._run(['du', '-s', prefix]).stdout.decode().split()[0])
+
+    def delete(self, paths):
+        self._run(['-m', 'rm', '-I'], input_paths=paths, check=False)
+
+    def copy(self, paths, dest_dir):
+        self._run(['-m', 'cp', '-I', dest_dir], input_paths=paths)
+
+    def move(self, paths, dest_dir):
+        self._run(['-m', 'mv', '-I', dest_dir], input_paths=paths)
+
+
+class GCSBackend(object):
+    """
+    Storage operations using the google-cloud-storage client
+
+    A single client (and its connections) is shared across calls; bulk
+    operations are run on num_threads threads.
+    """
+    def __init__(self, project=None, num_threads=16):
+        from google.cloud import storage
+        self._storage = storage
+        self.project = project
+        self.num_threads = num_threads
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = self._storage.Client(project=self.project)
+        return self._client
+
+    def _blob(self, path):
+        bucket, name = split_gs_path(path)
+        return self.client.bucket(bucket).blob(name)
+
+    def iter_files(self, prefix):
+        bucket, name = split_gs_path(prefix)
+        for b in self.client.list_blobs(bucket, prefix=name):
+            yield StorageObject('gs://{}/{}'.format(bucket, b.name), b.size,
+                None if b.md5_hash is None else base64.b64decode(b.md5_hash).hex(), b.updated)
+
+    def exists(self, path):
+        return self._blob(path).exists()
+
+    def cat(self, path, tail_bytes=None):
+        blob = self._blob(path)
+        if tail_bytes is None:
+            return blob.download_as_bytes()
+        blob.reload()
+        return blob.download_as_bytes(start=max(blob.size-int(tail_bytes), 0))
+
+    def md5(self, path):
+        blob = self._blob(path)
+        blob.reload()
+        if blob.md5_hash is None:
+            raise ValueError('No MD5 hash available for composite object {}'.format(path))
+        return base64.b64decode(blob.md5_hash).hex()
+
+    def du(self, prefix):
+        return np.int64(sum(i.size for i in self.iter_files(prefix)))
+
+    def _copy_file(self, path, dest_dir):
+        dest = dest_dir.rstrip('/')+'/'+os.path.basename(path)
+        if path.startswith('gs://') and dest.startswith('gs://'):
+            src = self._blob(path)
+            bucket, name = split_gs_path(dest)
+            src.bucket.copy_blob(src, self.client.bucket(bucket), name)
+        elif path.startswith('gs://'):
+            self._blob(path).download_to_filename(dest)
+        else:
+            self._blob(dest).upload_from_filename(path)
+
+    def delete(self, paths):
+        results = parallel_map(lambda x: self._blob(x).delete(), paths,
+            num_threads=self.num_threads, max_retries=2, return_exceptions=True)
+        failed = [(p,r) for p,r in zip(paths, results) if isinstance(r, Exception)]
+        for p,r in failed:
+            print('Could not delete {}: {}'.format(p, r))
+
+    def copy(self, paths, dest_dir):
+        parallel_map(lambda x: self._copy_file(x, dest_dir), paths,
+            num_threads=self.num_threads, max_retries=2)
+
+    def move(self, paths, dest_dir):
+        self.copy(paths, dest_dir)
+        self.delete(paths)
+
+
+class LocalBackend(object):
+    """
+    Storage operations on the local filesystem (e.g., for offline testing)
+
+    gs://bucket/object is mapped to <root>/bucket/object; other paths are
+    used as-is. Listings return paths in the form they were requested.
+    """
+    def __init__(self, root=None):
+        self.root = root
+
+    def _local(self, path):
+        if path.startswith('gs://'):
+            assert self.root is not None, 'LocalBackend requires a root directory for gs:// paths'
+            return os.path.join(self.root, path[5:])
+        return path
+
+    def iter_files(self, prefix):
+        local_prefix = self._local(prefix)
+        for root,dirs,files in os.walk(os.path.dirname(local_prefix)):
+            dirs.sort()
+            for f in sorted(files):
+                f = os.path.join(root, f)
+                if f.startswith(local_prefix):
+                    st = os.stat(f)
+                    if prefix.startswith('gs://'):
+                        f = 'gs://'+os.path.relpath(f, self.root)
+                    yield StorageObject(f, st.st_size, None, datetime.fromtimestamp(st.st_mtime, timezone.utc))
+
+    def exists(self, path):
+        return os.path.isfile(self._local(path))
+
+    def cat(self, path, tail_bytes=None):
+        with open(self._local(path), 'rb') as f:
+            if tail_bytes is not None:
+                f.seek(max(os.fstat(f.fileno()).st_size-int(tail_bytes), 0))
+            return f.read()
+
+    def md5(self, path):
+        h = hashlib.md5()
+        with open(self._local(path), 'rb') as f:
+            for b in iter(lambda: f.read(1024**2), b''):
+                h.update(b)
+        return h.hexdigest()
+
+    def du(self, prefix):
+        return np.int64(sum(i.size for i in self.iter_files(prefix)))
+
+    def delete(self, paths):
+        for p in paths:
+            try:
+                os.remove(self._local(p))
+            except OSError as e:
+                print('Could not delete {}: {}'.format(p, e))
+
+    def copy(self, paths, dest_dir):
+        dest_dir = self._local(dest_dir)
+        os.makedirs(dest_dir, exist_ok=True)
+        for p in paths:
+            shutil.copy(self._local(p), dest_dir)
+
+    def move(self, paths, dest_dir):
+        dest_dir = self._local(dest_dir)
+        os.makedirs(dest_dir, exist_ok=True)
+        for p in paths:
+            shutil.move(self._local(p), os.path.join(dest_dir, os.path.basename(p)))
+
+
+_storage_backend = None
+_local_backend = LocalBackend()
+
+def set_storage_backend(backend):
+    """
+    Set backend used for storage operations (gs_* functions)
+
+    backend: GCSBackend, GsutilBackend, LocalBackend, or None (default backend)
+    """
+    global _storage_backend
+    _storage_backend = backend
+
+
+def get_storage_backend(path=None):
+    """
+    Get backend used for storage operations. Defaults to GCSBackend if
+    google-cloud-storage is installed and application default credentials
+    are available, otherwise to GsutilBackend.
+    Local paths (not starting with gs://) are always handled locally.
+    """
+    global _storage_backend
+    if path is not None and not path.startswith('gs://') and not isinstance(_storage_backend, LocalBackend):
+        return _local_backend
+    if _storage_backend is None:
+        _storage_backend = GsutilBackend()
+        try:
+            from google.auth.exceptions import DefaultCredentialsError
+            backend = GCSBackend()
+        except ImportError:
+            return _storage_backend
+        try:
+            backend.client
+            _storage_backend = backend
+        except (DefaultCredentialsError, EnvironmentError):  # no credentials or project
+            pass
+    return _storage_backend
+
+
+#------------------------------------------------------------------------------
+#  Wrapper functions for storage operations
+#------------------------------------------------------------------------------
+
+def gs_list(prefix):
+    """
+    Iterate over all files starting with prefix (gs:// or local path)
+
+    Yields StorageObject(path, size, md5, updated) records
+    """
+    return get_storage_backend(prefix).iter_files(prefix)
+
+
+def _storage_records_to_df(records):
+    df = pd.DataFrame(records, columns=StorageObject._fields)
+    df['size'] = df['size'].astype(np.int64)
+    df['updated'] = pd.to_datetime(df['updated'], utc=True)
+    return df
+
+
+def gs_list_df(prefix, index_path=None, max_age=None, chunk_size=100000):
+    """
+    Get listing of all files starting with prefix as a DataFrame
+    with columns 'path', 'size', 'md5' and 'updated'
+
+    index_path: if set, the listing is stored in this file, and reused by
+                subsequent calls (if it is not older than max_age seconds)
+    """
+    if index_path is not None and os.path.exists(index_path):
+        if max_age is None or time.time()-os.path.getmtime(index_path) < max_age:
+            return pd.read_pickle(index_path)
+
+    # convert to columnar chunks while listing
+    chunks = []
+    records = []
+    for r in gs_list(prefix):
+        records.append(r)
+        if len(records)==chunk_size:
+            chunks.append(_storage_records_to_df(records))
+            records = []
+    chunks.append(_storage_records_to_df(records))
+    listing_df = pd.concat(chunks, ignore_index=True)
+
+    if index_path is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(index_path, os.getpid())
+        listing_df.to_pickle(tmp_path)
+        os.replace(tmp_path, index_path)
+    return listing_df
+
+
 def gs_list_bucket_files(bucket_id):
     """Get list of all files stored in bucket"""
-    s = subprocess.check_output('gsutil ls gs://{}/**'.format(bucket_id), shell=True)
-    return s.decode().strip().split('\n')
+    return [i.path for i in gs_list('gs://{}/'.format(bucket_id))]
 
 
-def gs_delete(file_list, chunk_size=500):
-    """Delete list of files (paths starting with gs://)"""
-    # number of calls is limited by command line size limit
+def gs_delete(file_list, chunk_size=500, num_threads=1):
+    """
+    Delete list of files (paths starting with gs://)
+
+    num_threads: number of chunks deleted concurrently
+    """
     n = int(np.ceil(len(file_list)/chunk_size))
-    for i in range(n):
-        x = file_list[chunk_size*i:chunk_size*(i+1)]
-        cmd = 'echo -e "{}" | gsutil -m rm -I'.format('\n'.join(x))
-        subprocess.call(cmd, shell=True)
+    backend = get_storage_backend()
+    parallel_map(backend.delete, [list(file_list[chunk_size*i:chunk_size*(i+1)]) for i in range(n)],
+        num_threads=num_threads, message='Deleting chunk' if n>1 else None)
 
 
 def gs_copy(file_list, dest_dir, chunk_size=500):
     """Copy list of files (paths starting with gs://)"""
     n = int(np.ceil(len(file_list)/chunk_size))
     for i in range(n):
-        x = file_list[chunk_size*i:chunk_size*(i+1)]
-        cmd = 'echo -e "{}" | gsutil -m cp -I {}'.format('\n'.join(x), dest_dir)
-        subprocess.check_call(cmd, shell=True)
+        x = list(file_list[chunk_size*i:chunk_size*(i+1)])
+        get_storage_backend().copy(x, dest_dir)
 
 
 def gs_move(file_list, dest_dir, chunk_size=500):
     """Move list of files (paths starting with gs://)"""
     n = int(np.ceil(len(file_list)/chunk_size))
     for i in range(n):
-        x = file_list[chunk_size*i:chunk_size*(i+1)]
-        cmd = 'echo -e "{}" | gsutil -m mv -I {}'.format('\n'.join(x), dest_dir)
-        subprocess.check_call(cmd, shell=True)
+        x = list(file_list[chunk_size*i:chunk_size*(i+1)])
+        get_storage_backend().move(x, dest_dir)
 
 
-def gs_exists(file_list_s):
+def gs_cat(path, tail_bytes=None):
     """
-    Check whether files exist
+    Get contents of a file (gs:// or local path) as str
 
-    file_list_s: pd.Series
+    tail_bytes: only return the last tail_bytes bytes of the file
     """
-    status_s = pd.Series(False, index=file_list_s.index, name='file_exists')
-    for k,(i,p) in enumerate(zip(file_list_s.index, file_list_s)):
-        print('\rChecking {}/{} files'.format(k+1, len(file_list_s)), end='')
-        try:
-            s = subprocess.check_output('gsutil -q stat {}'.format(p), shell=True)
-            status_s[i] = True
-        except subprocess.CalledProcessError as e:
-            s = e.stdout.decode()
-            print('{}: {}'.format(i, s))
-    return status_s
+    return get_storage_backend(path).cat(path, tail_bytes=tail_bytes).decode(errors='replace')
+
+
+def _gs_list_recursive(prefix):
+    """List all files under prefix (gs:// or local directory)"""
+    return [i.path for i in gs_list(prefix)]
+
+
+def _gs_stat(path):
+    """Check whether a single file (gs:// or local path) exists"""
+    return get_storage_backend(path).exists(path)
+
 
+def gs_exists(file_list_s, prefix_depth=1, min_group_size=10, num_threads=10):
+    """
+    Check whether files exist
 
-def gs_size(file_list_s):
+    file_list_s: pd.Series of paths (gs:// or local)
+
+    Paths are grouped by their first prefix_depth directories in the bucket.
+    Groups with at least min_group_size files are checked with a single
+    listing of their common prefix; the remaining files are checked with
+    individual (concurrent) stat calls.
+    """
+    # missing values (non-string paths) are reported as not existing
+    paths = pd.unique(file_list_s[file_list_s.apply(lambda x: isinstance(x, str))].values)
+    groups = defaultdict(list)
+    for p in paths:
+        groups['/'.join(p.split('/')[:3+prefix_depth])].append(p)
+
+    prefixes = []
+    stat_paths = []
+    for g in groups.values():
+        if len(g)>=min_group_size:
+            prefixes.append(os.path.commonprefix(g).rsplit('/', 1)[0]+'/')
+        else:
+            stat_paths.extend(g)
+
+    existing = set()
+    for r in parallel_map(_gs_list_recursive, prefixes, num_threads=num_threads, message='Listing prefix'):
+        existing.update(r)
+    for p,r in zip(stat_paths, parallel_map(_gs_stat, stat_paths, num_threads=num_threads, message='Checking file')):
+        if r:
+            existing.add(p)
+    return pd.Series(file_list_s.isin(existing).values, index=file_list_s.index, name='file_exists')
+
+
+def gs_size(file_list_s, listing_df=None):
     """
     Get file sizes (in bytes)
 
     file_list_s: pd.Series
+    listing_df: listing containing the files (see gs_list_df);
+                by default, the common prefix of the files is listed
     """
-    prefix = os.path.commonprefix(file_list_s.tolist())
-    s = subprocess.check_output('gsutil ls -l {}**'.format(prefix), shell=True)
-    gs_sizes = s.decode().strip().split('\n')[:-1]
-    gs_sizes = pd.Series([np.int64(i.split()[0]) for i in gs_sizes],
-        index=[i.split()[-1] for i in gs_sizes])
-    gs_sizes.index.name = 'path'
+    if listing_df is None:
+        listing_df = gs_list_df(os.path.commonprefix(file_list_s.tolist()))
+    gs_sizes = listing_df.set_index('path')['size']
     return pd.Series(gs_sizes[file_list_s].values, index=file_list_s.index, name='size_bytes')
 
 
+def gs_du(prefix):
+    """Get total size (in bytes) of all files starting with prefix"""
+    return get_storage_backend(prefix).du(prefix)
+
+
 def get_md5hash(file_path):
-    """Calculate MD5 hash using gsutil or md5sum, depending on location"""
-    if file_path.startswith('gs://'):
-        s = subprocess.check_output('gsutil hash -m -h '+file_path, shell=True).decode()
-        s = s.strip().split('\n')
-        s = [i for i in s if 'md5' in i][0]
-        return s.split()[-1]
-    else:
-        return subprocess.check_output('md5sum '+file_path, shell=True).decode().split()[0]
+    """Get MD5 hash of a file (gs:// or local path)"""
+    return get_storage_backend(file_path).md5(file_path)
+
 
+# MD5 hashes of local files (path -> (size, mtime, md5)), if no cache_path is used
+_md5_cache = {}
+_md5_cache_lock = threading.Lock()
 
-def get_md5hashes(file_list_s, num_threads=10):
-    """Parallelized get_md5hash()"""
-    md5_hashes = []
-    with mp.Pool(processes=num_threads) as pool:
-        for k,r in enumerate(pool.imap(get_md5hash, [i for i in file_list_s])):
-            print('\rCalculating MD5 hash for file {}/{}'.format(k+1,len(file_list_s)), end='')
-            md5_hashes.append(r)
+def get_md5hashes(file_list_s, num_threads=10, cache_path=None):
+    """
+    Parallelized get_md5hash()
+
+    Hashes of local files are cached by (path, size, mtime): on disk in
+    cache_path if set, otherwise in memory. Only the latest hash of each
+    path is kept. For gs:// paths, the MD5 stored in the object metadata
+    is used.
+    """
+    if cache_path is None:
+        cache, lock = _md5_cache, _md5_cache_lock
+    else:
+        cache, lock = {}, threading.Lock()
+        if os.path.exists(cache_path):
+            with open(cache_path, 'rb') as f:
+                cache = pickle.load(f)
+
+    def md5hash(path):
+        backend = get_storage_backend(path)
+        if not isinstance(backend, LocalBackend):
+            return backend.md5(path)
+        st = os.stat(backend._local(path))
+        entry = cache.get(path)
+        if entry is None or entry[:2]!=(st.st_size, st.st_mtime_ns):
+            entry = (st.st_size, st.st_mtime_ns, backend.md5(path))
+            with lock:
+                cache[path] = entry
+        return entry[2]
+
+    md5_hashes = parallel_map(md5hash, file_list_s, num_threads=num_threads,
+        message='Calculating MD5 hash for file')
+
+    if cache_path is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
     return md5_hashes
 
 
+#------------------------------------------------------------------------------
+#  Bucket inventory
+#------------------------------------------------------------------------------
+
+class BucketInventory(object):
+    """
+    Index of the files in a bucket (path, size, md5, updated; see gs_list_df)
+
+    The index is refreshed by prefix, and stored in index_path if set
+    (see save). Prefixes are relative to the bucket root, e.g.
+    '<submission_id>/'. Files are kept sorted by path, so that queries by
+    prefix do not scan the index.
+    """
+    def __init__(self, bucket_id, index_path=None):
+        self.bucket_id = bucket_id
+        self.root = 'gs://{}/'.format(bucket_id)
+        self.index_path = index_path
+        self.listing_df = _storage_records_to_df([])
+        self.last_refresh = None
+        self.metadata = {}  # state used by callers for incremental refreshes
+        if index_path is not None and os.path.exists(index_path):
+            with open(index_path, 'rb') as f:
+                index = pickle.load(f)
+            assert index['bucket_id']==bucket_id
+            self.listing_df = index['listing']
+            self.last_refresh = index['last_refresh']
+            self.metadata = index['metadata']
+        self._update_index()
+
+    def _update_index(self):
+        self._paths = self.listing_df['path'].to_numpy(dtype=object)
+        self._cumsize = np.concatenate([[0], np.cumsum(self.listing_df['size'].values)])
+
+    def _prefix_range(self, prefix):
+        prefix = self.root+prefix
+        return (np.searchsorted(self._paths, prefix, side='left'),
+                np.searchsorted(self._paths, prefix+'\U0010ffff', side='right'))
+
+    def save(self):
+        """Write index to index_path"""
+        if self.index_path is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(self.index_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'bucket_id':self.bucket_id, 'listing':self.listing_df,
+                'last_refresh':self.last_refresh, 'metadata':self.metadata}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.index_path)
+
+    def refresh(self, prefixes=None, num_threads=10):
+        """
+        Re-list all files under prefixes (default: entire bucket),
+        replacing the files previously indexed under these prefixes
+        """
+        if prefixes is None:
+            prefixes = ['']
+        listings = parallel_map(lambda x: gs_list_df(self.root+x), prefixes,
+            num_threads=num_threads, max_retries=2, message='Listing prefix')
+        keep = np.ones(len(self._paths), dtype=bool)
+        for p in prefixes:
+            lo, hi = self._prefix_range(p)
+            keep[lo:hi] = False
+        self.listing_df = pd.concat([self.listing_df[keep]]+listings, ignore_index=True)
+        self.listing_df = self.listing_df.drop_duplicates('path', keep='last').sort_values('path', ignore_index=True)
+        self.last_refresh = time.time()
+        self._update_index()
+
+    def remove(self, paths):
+        """Remove files (e.g., after deleting them) from index"""
+        self.listing_df = self.listing_df[~self.listing_df['path'].isin(paths)].reset_index(drop=True)
+        self._update_index()
+
+    def files(self, prefix=''):
+        """Files under prefix"""
+        lo, hi = self._prefix_range(prefix)
+        return self.listing_df.iloc[lo:hi]
+
+    def size(self, prefix=''):
+        """Total size (in bytes) of files under prefix"""
+        lo, hi = self._prefix_range(prefix)
+        return self._cumsize[hi] - self._cumsize[lo]
+
+    def size_by_prefix(self, depth=1):
+        """Total size (in bytes) of files, grouped by their first depth directories"""
+        sizes = {}
+        i = 0
+        while i<len(self._paths):
+            parts = self._paths[i][len(self.root):].split('/', depth)
+            if len(parts)>depth:
+                # skip to end of the (contiguous) range of files under this prefix
+                prefix = '/'.join(parts[:depth])
+                lo, i = self._prefix_range(prefix+'/')
+                sizes[prefix] = self._cumsize[i] - self._cumsize[lo]
+            else:
+                i += 1
+        sizes = pd.Series(sizes, dtype=np.int64)
+        sizes.index.name = 'prefix'
+        return sizes
+
+    def unreferenced(self, referenced_paths, prefix=''):
+        """
+        Files under prefix that are not in referenced_paths (set of paths;
+        paths ending with '/' reference all files in the directory)
+        """
+        lo, hi = self._prefix_range(prefix)
+        referenced_paths = set(referenced_paths)
+        mask = np.array([i not in referenced_paths for i in self._paths[lo:hi]], dtype=bool)
+        for p in referenced_paths:
+            if p.endswith('/') and p.startswith(self.root):
+                a, b = self._prefix_range(p[len(self.root):])
+                mask[max(a-lo, 0):max(min(b, hi)-lo, 0)] = False
+        return self.listing_df.iloc[lo:hi][mask]
+
+
 #------------------------------------------------------------------------------
 # Functions for parsing Google metadata
 #------------------------------------------------------------------------------
-def get_google_metadata(job_id):
+class GcloudOperationsTransport(object):
+    """Describe Google Genomics operations using gcloud"""
+    def describe(self, job_id):
+        s = subprocess.check_output(['gcloud', 'alpha', 'genomics', 'operations', 'describe', job_id, '--format', 'json'])
+        return json.loads(s.decode())
+
+
+class GenomicsAPITransport(object):
     """
-    jobid: operations ID
+    Describe Google Genomics operations with in-process requests to the
+    Genomics API, using application default credentials (the session
+    and its connections are reused across calls)
     """
+    def __init__(self, url='https://genomics.googleapis.com/v1alpha2/'):
+        import google.auth
+        from google.auth.transport.requests import AuthorizedSession
+        credentials, _ = google.auth.default(scopes=['https://www.googleapis.com/auth/cloud-platform'])
+        self.session = AuthorizedSession(credentials)
+        self.url = url
+
+    def describe(self, job_id):
+        r = self.session.get(self.url+job_id)
+        if r.status_code!=200:
+            raise ValueError('Operation request failed ({}): {}'.format(r.status_code, r.text))
+        return r.json()
+
+
+def get_google_metadata(job_id, num_threads=10, cache_dir=None, transport=None):
+    """
+    jobid: operations ID, or list of IDs (fetched concurrently, using num_threads)
+    cache_dir: if set, metadata of completed operations is cached on disk
+    transport: object that provides describe(job_id); default: GcloudOperationsTransport
+    """
+    if transport is None:
+        transport = GcloudOperationsTransport()
+    cache = JSONCache(cache_dir) if cache_dir is not None else None
+
+    def describe(j):
+        if cache is not None:
+            metadata = cache.get(tuple(j.split('/')))
+            if metadata is not None:
+                return metadata
+        metadata = transport.describe(j)
+        if cache is not None and metadata.get('done'):
+            cache.set(tuple(j.split('/')), metadata)
+        return metadata
+
     if isinstance(job_id, str):
-        s = subprocess.check_output('gcloud alpha genomics operations describe '+job_id+' --format json', shell=True)
-        return json.loads(s.decode())
+        return describe(job_id)
     elif isinstance(job_id, Iterable):
-        json_list = []
-        for k,j in enumerate(job_id):
-            print('\rFetching metadata ({}/{})'.format(k+1,len(job_id)), end='')
-            s = subprocess.check_output('gcloud alpha genomics operations describe '+j+' --format json', shell=True)
-            json_list.append(json.loads(s.decode()))
-        return json_list
+        return parallel_map(describe, job_id, num_threads=num_threads, max_retries=2,
+            message='Fetching metadata')
 
 
 def parse_google_stats(json_list):
     """
     Parse job start and end times, machine type, and preemption status from Google metadata
     """
-    df = pd.DataFrame(index=[j['name'] for j in json_list], columns=['time_h', 'machine_type', 'preemptible', 'preempted'])
-    for j in json_list:
-        event_dict = {k['description']:convert_time(k['startTime']) for k in j['metadata']['events'] if 'copied' not in k}
-        event_times = [convert_time(k['startTime']) for k in j['metadata']['events'] if 'copied' not in k]
-        time_delta = np.max(event_times) - np.min(event_times)
-        # if 'ok' in event_dict:
-        #     time_delta = convert_time(event_dict['ok']) - convert_time(event_dict['start'])
-        # elif 'start-shutdown' in event_dict:
-        #     time_delta = convert_time(event_dict['start-shutdown']) - convert_time(event_dict['start'])
-        # else:
-        #     raise ValueError('unknown event')
-        mt = j['metadata']['runtimeMetadata']['computeEngine']['machineType'].split('/')[-1]
-        p = j['metadata']['request']['ephemeralPipeline']['resources']['preemptible']
-        # j[0]['metadata']['request']['pipelineArgs']['resources']['preemptible']
-        df.loc[j['name'], ['time_h', 'machine_type', 'preemptible', 'preempted']] = [time_delta/3600, mt, p, 'ok' not in event_dict]
+    names = [j['name'] for j in json_list]
+    events_df = pd.DataFrame([[j['name'], k['description'], k['startTime']]
+        for j in json_list for k in j['metadata']['events'] if 'copied' not in k],
+        columns=['name', 'description', 'time'])
+    events_df['time'] = parse_timestamps(events_df['time'])
+    event_times = events_df.groupby('name')['time']
+    df = pd.DataFrame({
+        'time_h': ((event_times.max() - event_times.min()).dt.total_seconds()/3600).reindex(names).values,
+        'machine_type': pd.Categorical([j['metadata']['runtimeMetadata']['computeEngine']['machineType'].split('/')[-1]
+            for j in json_list]),
+        'preemptible': np.array([j['metadata']['request']['ephemeralPipeline']['resources']['preemptible']
+            for j in json_list], dtype=bool),
+        'preempted': ~events_df['description'].eq('ok').groupby(events_df['name']).any().reindex(names, fill_value=False).values,
+    }, index=names)
     return df
 
 
-def calculate_google_cost(jobid, jobid_lookup_df):
+def calculate_google_cost(jobid, jobid_lookup_df, region=None):
     """
     Calculate cost
+
+    jobid: job ID, or list of job IDs (returns pd.Series)
+    jobid_lookup_df: DataFrame from parse_google_stats
+    region: region for VM prices (see VMPricing)
     """
-    r = jobid_lookup_df.loc[jobid]
-    if r['preempted'] and r['time_h']<1/6:
-        return 0
-    else:
-        return r['time_h']*get_vm_cost(r['machine_type'], preemptible=r['preemptible'])
+    df = jobid_lookup_df.loc[[jobid] if isinstance(jobid, str) else jobid]
+    vm_cost = get_vm_pricing().get_cost(df['machine_type'].values, df['preemptible'].values, region=region)
+    time_h = df['time_h'].astype(float).values
+    # preemptions within the first 10 minutes are not charged
+    cost_s = pd.Series(np.where(df['preempted'].astype(bool) & (time_h<1/6), 0, time_h*vm_cost),
+        index=df.index, name='est_cost')
+    return cost_s.iloc[0] if isinstance(jobid, str) else cost_s
 
 
 #------------------------------------------------------------------------------
 # Functions for managing methods and configuration in the repository
 #------------------------------------------------------------------------------
+class RepositoryIndex(object):
+    """
+    Index of the methods or configurations in the repository, keyed by
+    (namespace, name), with snapshots sorted by snapshotId
+
+    The repository listing is downloaded by list_func at most once
+    every ttl seconds (None: until invalidated).
+    """
+    def __init__(self, list_func, ttl=300):
+        self.list_func = list_func
+        self.ttl = ttl
+        self._timestamp = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._timestamp = None
+
+    def _load(self):
+        with self._lock:
+            if self._timestamp is None or (self.ttl is not None and time.time()-self._timestamp >= self.ttl):
+                r = self.list_func()
+                assert r.status_code==200
+                self._listing = r.json()
+                index = defaultdict(list)
+                for m in self._listing:
+                    index[(m['namespace'], m['name'])].append(m)
+                self._index = {k:sorted(v, key=lambda x: x['snapshotId']) for k,v in index.items()}
+                self._names = defaultdict(list)
+                for namespace, name in sorted(self._index):
+                    self._names[namespace].append(name)
+                self._timestamp = time.time()
+
+    def listing(self):
+        """All snapshots"""
+        self._load()
+        return self._listing
+
+    def get(self, namespace, name):
+        """All snapshots of namespace/name, sorted by snapshotId"""
+        self._load()
+        return list(self._index.get((namespace, name), []))
+
+    def names(self, namespace):
+        """Sorted names in namespace"""
+        self._load()
+        return list(self._names.get(namespace, []))
+
+
+_method_index = RepositoryIndex(lambda: firecloud.api.list_repository_methods())
+_config_index = RepositoryIndex(lambda: firecloud.api.list_repository_configs())
+
+def set_repository_cache_ttl(ttl):
+    """Set lifetime (in seconds) of cached repository listings (None: until invalidated)"""
+    _method_index.ttl = ttl
+    _config_index.ttl = ttl
+
+
+def invalidate_repository_cache():
+    """Clear cached repository listings (methods and configurations)"""
+    _method_index.invalidate()
+    _config_index.invalidate()
+
+
 def list_methods(namespace=None):
     """
     List all methods in the repository
     """
-    r = firecloud.api.list_repository_methods()
-    assert r.status_code==200
-    r = r.json()
-
+    r = _method_index.listing()
     if namespace is not None:
         r = [m for m in r if m['namespace']==namespace]
 
@@ -201,11 +957,7 @@ def get_method(namespace, name):
     """
     Get all available versions of a method from the repository
     """
-    r = firecloud.api.list_repository_methods()
-    assert r.status_code==200
-    r = r.json()
-    r = [m for m in r if m['name']==name and m['namespace']==namespace]
-    return r
+    return _method_index.get(namespace, name)
 
 
 def get_method_version(namespace, name):
@@ -213,17 +965,16 @@ def get_method_version(namespace, name):
     Get latest method version
     """
     r = get_method(namespace, name)
-    return np.max([m['snapshotId'] for m in r])
+    if len(r)==0:
+        raise ValueError('Method "{}/{}" not found.'.format(namespace, name))
+    return r[-1]['snapshotId']
 
 
 def list_configs(namespace=None):
     """
     List all configurations in the repository
     """
-    r = firecloud.api.list_repository_configs()
-    assert r.status_code==200
-    r = r.json()
-
+    r = _config_index.listing()
     if namespace is not None:
         r = [m for m in r if m['namespace']==namespace]
 
@@ -234,11 +985,7 @@ def get_config(namespace, name):
     """
     Get all versions of a configuration from the repository
     """
-    r = firecloud.api.list_repository_configs()
-    assert r.status_code==200
-    r = r.json()
-    r = [m for m in r if m['name']==name and m['namespace']==namespace]
-    return r
+    return _config_index.get(namespace, name)
 
 
 def get_config_version(namespace, name):
@@ -246,33 +993,25 @@ def get_config_version(namespace, name):
     Get latest config version
     """
     r = get_config(namespace, name)
-    return np.max([m['snapshotId'] for m in r])
+    if len(r)==0:
+        raise ValueError('Configuration "{}/{}" not found.'.format(namespace, name))
+    return r[-1]['snapshotId']
 
 
 def print_methods(namespace):
     """
     Print all methods in a namespace
     """
-    r = firecloud.api.list_repository_methods()
-    assert r.status_code==200
-    r = r.json()
-    r = [m for m in r if m['namespace']==namespace]
-    methods = np.unique([m['name'] for m in r])
-    for k in methods:
-        print('{}: {}'.format(k, np.max([m['snapshotId'] for m in r if m['name']==k])))
+    for k in _method_index.names(namespace):
+        print('{}: {}'.format(k, get_method_version(namespace, k)))
 
 
 def print_configs(namespace):
     """
     Print all configurations in a namespace
     """
-    r = firecloud.api.list_repository_configs()
-    assert r.status_code==200
-    r = r.json()
-    r = [m for m in r if m['namespace']==namespace]
-    configs = np.unique([m['name'] for m in r])
-    for k in configs:
-        print('{}: {}'.format(k, np.max([m['snapshotId'] for m in r if m['name']==k])))
+    for k in _config_index.names(namespace):
+        print('{}: {}'.format(k, get_config_version(namespace, k)))
 
 
 def get_wdl(method_namespace, method_name, snapshot_id=None):
@@ -326,11 +1065,8 @@ def redact_method(method_namespace, method_name, mode='outdated'):
     mode: 'outdated', 'latest', 'all'
     """
     assert mode in ['outdated', 'latest', 'all']
-    r = firecloud.api.list_repository_methods()
-    assert r.status_code==200
-    r = r.json()
-    r = [m for m in r if m['name']==method_name and m['namespace']==method_namespace]
-    versions = np.sort([m['snapshotId'] for m in r])
+    r = get_method(method_namespace, method_name)
+    versions = np.array([m['snapshotId'] for m in r])
     print('Versions: {}'.format(', '.join(map(str, versions))))
     if mode == 'outdated':
         versions = versions[:-1]
@@ -339,6 +1075,7 @@ def redact_method(method_namespace, method_name, mode='outdated'):
     for i in versions:
         print('  * deleting version {}'.format(i))
         r = firecloud.api.delete_repository_method(method_namespace, method_name, i)
+        _method_index.invalidate()
         assert r.status_code==200
 
 
@@ -350,12 +1087,13 @@ def update_method(namespace, method, synopsis, wdl_file, public=False, delete_ol
     r = get_method(namespace, method)
     old_version = None
     if r:
-        old_version = np.max([m['snapshotId'] for m in r])
+        old_version = r[-1]['snapshotId']
         print('Method {}/{} exists. SnapshotID: {}'.format(
             namespace, method, old_version))
 
     # push new version
     r = firecloud.api.update_repository_method(namespace, method, synopsis, wdl_file)
+    _method_index.invalidate()
     if r.status_code==201:
         print("Successfully pushed {}/{}. New SnapshotID: {}".format(namespace, method, r.json()['snapshotId']))
     else:
@@ -369,6 +1107,7 @@ def update_method(namespace, method, synopsis, wdl_file, public=False, delete_ol
     # delete old version
     if old_version is not None and delete_old:
         r = firecloud.api.delete_repository_method(namespace, method, old_version)
+        _method_index.invalidate()
         assert r.status_code==200
         print("Successfully deleted SnapshotID {}.".format(old_version))
 
@@ -376,62 +1115,201 @@ def update_method(namespace, method, synopsis, wdl_file, public=False, delete_ol
 #------------------------------------------------------------------------------
 # VM costs
 #------------------------------------------------------------------------------
-def get_vm_cost(machine_type, preemptible=True):
+# hourly prices (USD), us-central1
+_PREEMPTIBLE_PRICES = {
+    'n1-standard-1': 0.0100,  # 3.75 GB
+    'n1-standard-2': 0.0200,  # 7.5 GB
+    'n1-standard-4': 0.0400,  # 15  GB
+    'n1-standard-8': 0.0800,  # 30  GB
+    'n1-standard-16':0.1600,  # 60  GB
+    'n1-standard-32':0.3200,  # 120 GB
+    'n1-standard-64':0.6400,  # 240 GB
+    'n1-highmem-2':  0.0250,  # 13  GB
+    'n1-highmem-4':  0.0500,  # 26  GB
+    'n1-highmem-8':  0.1000,  # 52  GB
+    'n1-highmem-16': 0.2000,  # 104 GB
+    'n1-highmem-32': 0.4000,  # 208 GB
+    'n1-highmem-64': 0.8000,  # 416 GB
+    'n1-highcpu-2':  0.0150,  # 1.80 GB
+    'n1-highcpu-4':  0.0300,  # 3.60 GB
+    'n1-highcpu-8':  0.0600,  # 7.20 GB
+    'n1-highcpu-16': 0.1200,  # 14.40 GB
+    'n1-highcpu-32': 0.2400,  # 28.80 GB
+    'n1-highcpu-64': 0.4800,  # 57.6 GB
+    'f1-micro':      0.0035,  # 0.6 GB
+    'g1-small':      0.0070,  # 1.7 GB
+}
+
+_STANDARD_PRICES = {
+    'n1-standard-1': 0.0475,
+    'n1-standard-2': 0.0950,
+    'n1-standard-4': 0.1900,
+    'n1-standard-8': 0.3800,
+    'n1-standard-16': 0.7600,
+    'n1-standard-32': 1.5200,
+    'n1-standard-64': 3.0400,
+    'n1-highmem-2':  0.1184,
+    'n1-highmem-4':  0.2368,
+    'n1-highmem-8':  0.4736,
+    'n1-highmem-16': 0.9472,
+    'n1-highmem-32': 1.8944,
+    'n1-highmem-64': 3.7888,
+    'n1-highcpu-2':  0.0709,
+    'n1-highcpu-4':  0.1418,
+    'n1-highcpu-8':  0.2836,
+    'n1-highcpu-16': 0.5672,
+    'n1-highcpu-32': 1.1344,
+    'n1-highcpu-64': 2.2688,
+    'f1-micro':      0.0076,
+    'g1-small':      0.0257,
+}
+
+# custom machine types: hourly price per vCPU and per GB of memory
+_CUSTOM_PRICES = [
+    {'family':'n1', 'preemptible':False, 'cpu':0.033174, 'memory':0.004446},
+    {'family':'n1', 'preemptible':True,  'cpu':0.00698,  'memory':0.00094},
+]
+
+# persistent disks: monthly price per GB
+_DISK_PRICES = [
+    {'disk_type':'pd-standard', 'price':0.040},
+    {'disk_type':'pd-ssd',      'price':0.170},
+    {'disk_type':'local-ssd',   'price':0.080},
+]
+
+
+# custom machine types: [<family>-]custom-<vCPUs>-<memory in MB>
+_CUSTOM_MACHINE_TYPE = r'^(?:(\w+)-)?custom-(\d+)-(\d+)(?:-ext)?$'
+
+
+def get_vm_cpus(machine_type):
+    """
+    Number of vCPUs for each machine type (pd.Series);
+    shared-core (e.g., g1-small), unknown and missing types: 1
+    """
+    machine_type = pd.Series(machine_type, dtype=object)
+    cpus = machine_type.str.extract(_CUSTOM_MACHINE_TYPE)[1]
+    cpus = cpus.fillna(machine_type.str.rsplit('-', n=1).str[-1])
+    return pd.to_numeric(cpus, errors='coerce').fillna(1)
+
+
+class VMPricing(object):
+    """
+    Catalog of VM prices (USD per hour)
+
+    Prices are defined by machine type and preemptibility, and optionally by
+    region (prices without region apply to all regions). Custom machine
+    types ([<family>-]custom-<vCPUs>-<memory in MB>) are priced per vCPU and
+    GB of memory. Unknown machine types have a cost of NaN.
+    """
+    def __init__(self, machine_types=None, custom=None, disks=None):
+        """
+        machine_types: records with 'machine_type', 'preemptible', 'price', ['region']
+        custom: records with 'family', 'preemptible', 'cpu', 'memory', ['region']
+        disks: records with 'disk_type', 'price' (per GB-month), ['region']
+        """
+        self._prices = {}
+        self._custom_prices = {}
+        self._disk_prices = {}
+        self.add_prices(machine_types=machine_types, custom=custom, disks=disks)
+
+    @classmethod
+    def default(cls):
+        """Catalog with built-in prices"""
+        return cls(
+            machine_types=[{'machine_type':k, 'preemptible':True, 'price':v} for k,v in _PREEMPTIBLE_PRICES.items()]
+                         +[{'machine_type':k, 'preemptible':False, 'price':v} for k,v in _STANDARD_PRICES.items()],
+            custom=_CUSTOM_PRICES, disks=_DISK_PRICES)
+
+    @classmethod
+    def from_file(cls, path, include_defaults=True):
+        """
+        Load prices from JSON (dict with 'machine_types', 'custom' and/or
+        'disks' lists of records) or CSV (machine type records) file.
+        Loaded prices take precedence over built-in prices.
+        """
+        pricing = cls.default() if include_defaults else cls()
+        if path.endswith('.csv'):
+            pricing.add_prices(machine_types=pd.read_csv(path).to_dict('records'))
+        else:
+            with open(path) as f:
+                pricing.add_prices(**json.load(f))
+        return pricing
+
+    def add_prices(self, machine_types=None, custom=None, disks=None):
+        """Add or update prices (see __init__)"""
+        def region(r):
+            return None if pd.isnull(r.get('region')) else r['region']
+        for r in machine_types or []:
+            self._prices[(region(r), r['machine_type'], bool(r['preemptible']))] = float(r['price'])
+        for r in custom or []:
+            self._custom_prices[(region(r), r['family'], bool(r['preemptible']))] = (float(r['cpu']), float(r['memory']))
+        for r in disks or []:
+            self._disk_prices[(region(r), r['disk_type'])] = float(r['price'])
+
+    def _get_price(self, machine_type, preemptible, region):
+        for k in [(region, machine_type, preemptible), (None, machine_type, preemptible)]:
+            if k in self._prices:
+                return self._prices[k]
+        m = re.match(_CUSTOM_MACHINE_TYPE, machine_type)
+        if m is not None:
+            family = m.group(1) or 'n1'
+            for k in [(region, family, preemptible), (None, family, preemptible)]:
+                if k in self._custom_prices:
+                    cpu, memory = self._custom_prices[k]
+                    return int(m.group(2))*cpu + int(m.group(3))/1024*memory
+        return np.nan
+
+    def get_cost(self, machine_type, preemptible=True, region=None):
+        """
+        Cost per hour
+
+        machine_type, preemptible: scalars, or array-like (returns np.array)
+        """
+        scalar = np.ndim(machine_type)==0
+        machine_type = np.atleast_1d(np.asarray(machine_type, dtype=object))
+        preemptible = np.broadcast_to(np.asarray(preemptible), machine_type.shape)
+        if preemptible.dtype!=bool:  # missing values: preemptible
+            preemptible = pd.Series(preemptible, dtype=object).fillna(True).astype(bool).values
+
+        # look up prices once per machine type
+        codes, machine_types = pd.factorize(machine_type)
+        prices = np.array([[self._get_price(m, p, region) for p in [False, True]] for m in machine_types]+[[np.nan, np.nan]])
+        unknown = [m for m,c in zip(machine_types, prices) if np.isnan(c).all()]
+        if len(unknown)>0:
+            print('Unknown machine type(s): {}'.format(', '.join(unknown)))
+        cost = prices[codes, preemptible.astype(int)]  # code -1 (null machine type): NaN
+        return cost[0] if scalar else cost
+
+    def get_disk_cost(self, disk_type, size_gb, region=None):
+        """Cost per hour"""
+        price = self._disk_prices.get((region, disk_type), self._disk_prices.get((None, disk_type), np.nan))
+        return price*np.asarray(size_gb)/730
+
+
+_vm_pricing = None
+
+def set_vm_pricing(pricing):
+    """Set VM pricing catalog (VMPricing, path to JSON/CSV file, or None for built-in prices)"""
+    global _vm_pricing
+    if isinstance(pricing, str):
+        pricing = VMPricing.from_file(pricing)
+    _vm_pricing = pricing
+
+
+def get_vm_pricing():
+    """Get VM pricing catalog"""
+    global _vm_pricing
+    if _vm_pricing is None:
+        _vm_pricing = VMPricing.default()
+    return _vm_pricing
+
+
+def get_vm_cost(machine_type, preemptible=True, region=None):
     """
     Cost per hour
     """
-    preemptible_dict = {
-        'n1-standard-1': 0.0100,  # 3.75 GB
-        'n1-standard-2': 0.0200,  # 7.5 GB
-        'n1-standard-4': 0.0400,  # 15  GB
-        'n1-standard-8': 0.0800,  # 30  GB
-        'n1-standard-16':0.1600,  # 60  GB
-        'n1-standard-32':0.3200,  # 120 GB
-        'n1-standard-64':0.6400,  # 240 GB
-        'n1-highmem-2':  0.0250,  # 13  GB
-        'n1-highmem-4':  0.0500,  # 26  GB
-        'n1-highmem-8':  0.1000,  # 52  GB
-        'n1-highmem-16': 0.2000,  # 104 GB
-        'n1-highmem-32': 0.4000,  # 208 GB
-        'n1-highmem-64': 0.8000,  # 416 GB
-        'n1-highcpu-2':  0.0150,  # 1.80 GB
-        'n1-highcpu-4':  0.0300,  # 3.60 GB
-        'n1-highcpu-8':  0.0600,  # 7.20 GB
-        'n1-highcpu-16': 0.1200,  # 14.40 GB
-        'n1-highcpu-32': 0.2400,  # 28.80 GB
-        'n1-highcpu-64': 0.4800,  # 57.6 GB
-        'f1-micro':      0.0035,  # 0.6 GB
-        'g1-small':      0.0070,  # 1.7 GB
-    }
-
-    standard_dict = {
-        'n1-standard-1': 0.0475,
-        'n1-standard-2': 0.0950,
-        'n1-standard-4': 0.1900,
-        'n1-standard-8': 0.3800,
-        'n1-standard-16': 0.7600,
-        'n1-standard-32': 1.5200,
-        'n1-standard-64': 3.0400,
-        'n1-highmem-2':  0.1184,
-        'n1-highmem-4':  0.2368,
-        'n1-highmem-8':  0.4736,
-        'n1-highmem-16': 0.9472,
-        'n1-highmem-32': 1.8944,
-        'n1-highmem-64': 3.7888,
-        'n1-highcpu-2':  0.0709,
-        'n1-highcpu-4':  0.1418,
-        'n1-highcpu-8':  0.2836,
-        'n1-highcpu-16': 0.5672,
-        'n1-highcpu-32': 1.1344,
-        'n1-highcpu-64': 2.2688,
-        'f1-micro':      0.0076,
-        'g1-small':      0.0257,
-    }
-
-    if preemptible:
-        return preemptible_dict[machine_type]
-    else:
-        return standard_dict[machine_type]
+    return get_vm_pricing().get_cost(machine_type, preemptible=preemptible, region=region)
 
 
 def main(argv=None):
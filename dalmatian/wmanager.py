@@ -4,11 +4,17 @@ import numpy as np
 import subprocess
 import os
 import io
+import json
+import re
+import hashlib
+import time
+import threading
 from collections import defaultdict
 import firecloud.api
 from firecloud import fiss
 import iso8601
 import pytz
+import requests
 from datetime import datetime
 from .core import *
 
@@ -68,6 +74,153 @@ def _batch_update_entities(namespace, workspace, json_body):
     return firecloud.api.__post(uri, headers=headers, json=json_body)
 
 
+def _is_number(x):
+    return isinstance(x, (int, float, np.number)) and not isinstance(x, (bool, np.bool_))
+
+
+def _values_equal(x, y):
+    """
+    Compare attribute values: numbers are compared as numbers (1 == 1.0),
+    booleans as serialized by FireCloud ('true'), everything else as strings
+    """
+    if _is_number(x) and _is_number(y):
+        return x==y
+    if isinstance(x, (bool, np.bool_)) or isinstance(y, (bool, np.bool_)):
+        return str(x).lower()==str(y).lower()
+    return str(x)==str(y)
+
+
+def _diff_operations(etype, attrs, current_df):
+    """
+    Batch update operations for values in attrs (pd.DataFrame) that differ
+    from current_df. Returns the operations and the number of unchanged
+    (skipped) values per entity.
+    """
+    current_df = current_df.reindex(index=attrs.index, columns=attrs.columns)
+    new_null = attrs.isnull().values
+    current_null = current_df.isnull().values
+    columns = attrs.columns.tolist()
+    attr_list = []
+    skipped = []
+    for i,row,current_row,n_null,c_null in zip(attrs.index, attrs.values.tolist(),
+            current_df.values.tolist(), new_null, current_null):
+        operations = []
+        for c,j,k,nn,cn in zip(columns, row, current_row, n_null, c_null):
+            if nn:
+                if not cn:
+                    operations.append({"op": "RemoveAttribute", "attributeName":c})
+            elif cn or not _values_equal(j, k):
+                operations.append({"op": "AddUpdateAttribute", "attributeName":c, "addUpdateAttribute":str(j)})
+        if len(operations)>0:
+            attr_list.append({'name':i, 'entityType':etype, 'operations':operations})
+        skipped.append(len(columns)-len(operations))
+    return attr_list, pd.Series(skipped, index=attrs.index)
+
+
+def _get_call_attempts(metadata_dict):
+    """
+    Flatten workflow metadata (dict of metadata JSON, indexed by entity)
+    into a DataFrame with one row per call attempt (numbered from 0 for
+    each task and shard). For each task and shard, the last attempt is
+    considered successful.
+    """
+    attempts = []
+    quota_events = []
+    for i,m in metadata_dict.items():
+        for t,calls in m['calls'].items():
+            scatter = 'shardIndex' in calls[0]
+            for j in calls:
+                attempts.append([i, m['workflowName'], t, j['shardIndex'] if scatter else 0, np.nan,
+                    j.get('start'), j.get('end'),
+                    j['jes']['machineType'].rsplit('/')[-1] if 'machineType' in j.get('jes', {}) else np.nan,
+                    j.get('preemptible', np.nan),
+                    'hit' in j.get('callCaching', {}) and j['callCaching']['hit'],
+                    j.get('jobId', np.nan)])
+                quota_events.extend([[len(attempts)-1, e['startTime'], e['endTime']]
+                    for e in j.get('executionEvents', []) if e['description']=='waiting for quota'])
+    df = pd.DataFrame(attempts, columns=['entity', 'workflow', 'task', 'shard', 'attempt',
+        'start', 'end', 'machine_type', 'preemptible', 'call_cache_hit', 'job_id'])
+    df['start'] = parse_timestamps(df['start'])
+    df['end'] = parse_timestamps(df['end'])
+    df['time_h'] = (df['end'] - df['start']).dt.total_seconds()/3600
+
+    quota_df = pd.DataFrame(quota_events, columns=['row', 'start', 'end'])
+    quota_h = (parse_timestamps(quota_df['end']) - parse_timestamps(quota_df['start'])).dt.total_seconds()/3600
+    df['quota_h'] = quota_h.groupby(quota_df['row'].values).sum().reindex(df.index).fillna(0)
+    df['attempt'] = df.groupby(['entity', 'task', 'shard']).cumcount()
+    df['success'] = ~df.duplicated(['entity', 'task', 'shard'], keep='last')
+    return df
+
+
+def _get_gs_paths(values):
+    """
+    Get set of gs:// paths in values (str, lists of str, or str
+    representations of lists, e.g. "['gs://a', 'gs://b']")
+    """
+    paths = set()
+    for x in values:
+        if isinstance(x, str):
+            if x.startswith('gs://'):
+                paths.add(x)
+            # paths embedded in strings (e.g., lists stored as str or JSON)
+            paths.update(re.findall(r'gs://[^\s\'",\[\]]+', x))
+        elif isinstance(x, (list, tuple, np.ndarray)):
+            paths.update(_get_gs_paths(x))
+        elif isinstance(x, dict) and 'items' in x:  # raw attribute lists
+            paths.update(_get_gs_paths(x['items']))
+    return paths
+
+
+def _is_retryable(e):
+    """Only server errors (5xx) and connection errors are retried"""
+    if isinstance(e, requests.HTTPError):
+        return e.response is not None and e.response.status_code>=500
+    # client-side failures (e.g., missing metadata keys or files) will not recover
+    return not isinstance(e, (LookupError, FileNotFoundError))
+
+
+def _chunk_by_size(json_body, max_bytes=1024**2):
+    """Split a batch update body into chunks with bounded JSON payload size"""
+    chunks = []
+    chunk = []
+    chunk_bytes = 0
+    for e in json_body:
+        n = len(json.dumps(e)) + 2  # separator
+        if len(chunk)>0 and chunk_bytes+n>max_bytes:
+            chunks.append(chunk)
+            chunk = []
+            chunk_bytes = 0
+        chunk.append(e)
+        chunk_bytes += n
+    if len(chunk)>0:
+        chunks.append(chunk)
+    return chunks
+
+
+#------------------------------------------------------------------------------
+#  Helper functions for decoding entity JSON
+#------------------------------------------------------------------------------
+def _decode_attribute(x):
+    """Unwrap list ('items') and entity reference ('entityName') attributes"""
+    if isinstance(x, dict):
+        if 'items' in x:
+            return [i['entityName'] if isinstance(i, dict) and 'entityName' in i else i for i in x['items']]
+        elif 'entityName' in x:
+            return x['entityName']
+    return x
+
+
+def _decode_entities(entities):
+    """Convert a page of entities (JSON) to a DataFrame, one column per attribute"""
+    columns = {}
+    for k,e in enumerate(entities):
+        for a,x in e['attributes'].items():
+            if a not in columns:
+                columns[a] = np.full(len(entities), np.nan, dtype=object)
+            columns[a][k] = _decode_attribute(x)
+    return pd.DataFrame(columns, index=[e['name'] for e in entities])
+
+
 #------------------------------------------------------------------------------
 #  Top-level classes representing workspace(s)
 #------------------------------------------------------------------------------
@@ -101,13 +254,33 @@ class WorkspaceCollection(object):
 
 
 class WorkspaceManager(object):
-    def __init__(self, namespace, workspace=None, timezone='America/New_York'):
+    def __init__(self, namespace, workspace=None, timezone='America/New_York',
+                 cache_ttl=0, cache_dir=None, metadata_cache_size=2*1024**3):
+        """
+        cache_ttl: lifetime (in seconds) of cached entity tables.
+                   0 disables caching; None caches until invalidated.
+        cache_dir: if set, cached entity tables are also stored on disk
+                   and reused across sessions, and metadata of completed
+                   workflows is cached on disk.
+        metadata_cache_size: maximum size of the workflow metadata cache
+                   (in bytes, compressed)
+        """
         if workspace is None:
             self.namespace, self.workspace = namespace.split('/')
         else:
             self.namespace = namespace
             self.workspace = workspace
         self.timezone  = timezone
+        self.cache_ttl = cache_ttl
+        self.cache_dir = os.path.expanduser(cache_dir) if cache_dir is not None else None
+        self._entity_cache = {}
+        self._upload_checkpoints = {}
+        self._bucket_inventory = None
+        if self.cache_dir is not None:
+            self._metadata_cache = JSONCache(os.path.join(self.cache_dir, self.namespace,
+                self.workspace, 'metadata'), max_bytes=metadata_cache_size)
+        else:
+            self._metadata_cache = None
 
 
     def create_workspace(self, wm=None):
@@ -116,6 +289,7 @@ class WorkspaceManager(object):
             r = firecloud.api.create_workspace(self.namespace, self.workspace)
             if r.status_code==201:
                 print('Workspace {}/{} successfully created.'.format(self.namespace, self.workspace))
+                self.invalidate_entity_cache()
             elif r.status_code==409:
                 print(r.json()['message'])
             else:
@@ -125,6 +299,7 @@ class WorkspaceManager(object):
             if r.status_code==201:
                 print('Workspace {}/{} successfully cloned from {}/{}.'.format(
                     self.namespace, self.workspace, wm.namespace, wm.workspace))
+                self.invalidate_entity_cache()
             else:
                 print(r.text)
 
@@ -133,6 +308,7 @@ class WorkspaceManager(object):
         """Delete the workspace"""
         r = firecloud.api.delete_workspace(self.namespace, self.workspace)
         if r.status_code==202:
+            self.invalidate_entity_cache()
             print('Workspace {}/{} successfully deleted.'.format(self.namespace, self.workspace))
             print('  * '+r.json()['message'])
         else:
@@ -148,27 +324,92 @@ class WorkspaceManager(object):
         return bucket_id
 
 
-    def upload_entities(self, etype, df, index=True):
-        """"""
-        buf = io.StringIO()
-        df.to_csv(buf, sep='\t', index=index)
-        s = firecloud.api.upload_entities(self.namespace, self.workspace, buf.getvalue())
-        buf.close()
+    def upload_entities(self, etype, df, index=True, chunk_size=None, num_threads=4, resume=False):
+        """
+        Upload entities stored in a DataFrame (in TSV load file format)
+
+        chunk_size: upload in chunks of at most chunk_size rows. Entity
+                    chunks are uploaded in parallel (num_threads), set
+                    membership chunks sequentially.
+        resume:     if some chunks of the previous upload of etype failed,
+                    re-running the same upload with resume=True skips the
+                    chunks that were already imported (also across
+                    sessions if cache_dir is set). Otherwise, all chunks
+                    are uploaded.
+        """
         et = etype.replace('_set', ' set')
-        if s.status_code==200:
-            if 'set' in etype:
-                if index:
-                    sets = df.index
-                else:
-                    sets = df[df.columns[0]]
-                print('Successfully imported {} {}s:'.format(len(np.unique(sets)), et))
-                for s in np.unique(sets):
-                    print('  * {} ({} {}s)'.format(s, np.sum(sets==s), et.replace(' set','')))
+        if chunk_size is None:
+            chunk_size = max(df.shape[0], 1)
+        chunks = [df.iloc[i:i+chunk_size] for i in range(0, max(df.shape[0], 1), chunk_size)]
+        if not resume:
+            self._clear_upload_checkpoint(etype)
+        elif etype not in self._upload_checkpoints:
+            self._upload_checkpoints[etype] = set()
+            if self.cache_dir is not None and os.path.exists(self._upload_checkpoint_path(etype)):
+                with open(self._upload_checkpoint_path(etype)) as f:
+                    self._upload_checkpoints[etype].update(json.load(f))
+        confirmed = self._upload_checkpoints.setdefault(etype, set())
+        lock = threading.Lock()
+
+        def upload(chunk):
+            buf = io.StringIO()
+            chunk.to_csv(buf, sep='\t', index=index)
+            tsv = buf.getvalue()
+            buf.close()
+            key = hashlib.md5(tsv.encode()).hexdigest()
+            if key not in confirmed:
+                s = firecloud.api.upload_entities(self.namespace, self.workspace, tsv)
+                if s.status_code!=200:
+                    raise ValueError(s.text)
+                with lock:
+                    confirmed.add(key)
+                    if self.cache_dir is not None:
+                        self._save_upload_checkpoint(etype)
+
+        results = parallel_map(upload, chunks, num_threads=1 if 'set' in etype else num_threads,
+            return_exceptions=True, message='Uploading {}s, chunk'.format(et) if len(chunks)>1 else None)
+        self.invalidate_entity_cache(etype)
+        failed = [e for e in results if isinstance(e, Exception)]
+        if len(failed)>0:
+            for e in failed:
+                print(e)
+            if len(chunks)>1:
+                print('{}/{} chunks failed. Re-run with resume=True to upload the remaining chunks.'.format(len(failed), len(chunks)))
+            raise ValueError('{} import failed.'.format(et.capitalize()))
+        self._clear_upload_checkpoint(etype)
+
+        if 'set' in etype:
+            if index:
+                sets = pd.Series(df.index)
             else:
-                print('Successfully imported {} {}s.'.format(df.shape[0], et))
+                sets = df[df.columns[0]]
+            set_sizes = sets.groupby(sets.values).size()
+            print('Successfully imported {} {}s:'.format(len(set_sizes), et))
+            for s,n in set_sizes.items():
+                print('  * {} ({} {}s)'.format(s, n, et.replace(' set','')))
         else:
-            print(s.text)
-            raise ValueError('{} import failed.'.format(et.capitalize()))
+            print('Successfully imported {} {}s.'.format(df.shape[0], et))
+
+
+    def _upload_checkpoint_path(self, etype):
+        return os.path.join(self.cache_dir, self.namespace, self.workspace,
+                            'uploads', etype+'.json')
+
+
+    def _save_upload_checkpoint(self, etype):
+        """Store the hashes of uploaded chunks on disk"""
+        path = self._upload_checkpoint_path(etype)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(sorted(self._upload_checkpoints[etype]), f)
+        os.replace(tmp_path, path)
+
+
+    def _clear_upload_checkpoint(self, etype):
+        self._upload_checkpoints.pop(etype, None)
+        if self.cache_dir is not None and os.path.exists(self._upload_checkpoint_path(etype)):
+            os.remove(self._upload_checkpoint_path(etype))
 
 
     def upload_participants(self, participant_ids):
@@ -227,21 +468,61 @@ class WorkspaceManager(object):
         else:
             raise ValueError('Entity type {} not supported'.format(etype))
 
-        entitites_dict = {k:g.index.values for k,g in df.groupby('participant')}
-        participant_ids = np.unique(df['participant'])
+        attr_list = [{
+            'name':k,
+            'entityType':'participant',
+            'operations':[firecloud.api._attr_set("{}s_".format(etype), {
+                "itemsType": "EntityReference",
+                "items": [{"entityType": etype, "entityName": i} for i in g.index]
+            })]
+        } for k,g in df.groupby('participant')]
 
-        for j,k in enumerate(participant_ids):
-            print('\r    Updating {}s for participant {}/{}'.format(etype, j+1, len(participant_ids)), end='')
-            attr_dict = {
-                "{}s_".format(etype): {
-                    "itemsType": "EntityReference",
-                    "items": [{"entityType": etype, "entityName": i} for i in entitites_dict[k]]
-                }
-            }
-            attrs = [firecloud.api._attr_set(i,j) for i,j in attr_dict.items()]
-            r = firecloud.api.update_entity(self.namespace, self.workspace, 'participant', k, attrs)
-            assert r.status_code==200
-        print('\n    Finished attaching {}s to {} participants'.format(etype, len(participant_ids)))
+        result_df = self._batch_update('participant', attr_list,
+            message='    Updating {}s for participants, chunk'.format(etype))
+        n_failed = np.sum(result_df['status']=='failed')
+        print('    Finished attaching {}s to {} participants'.format(etype, len(attr_list)-n_failed))
+        if n_failed>0:
+            print('    Update failed for {} participants'.format(n_failed))
+        return result_df
+
+
+    def _batch_update(self, etype, attr_list, max_bytes=1024**2, num_threads=4, max_retries=2, message=None):
+        """
+        Send batch update operations in chunks of at most max_bytes,
+        using num_threads concurrent requests. Only server errors (5xx)
+        and connection errors are retried.
+
+        Returns a DataFrame indexed by entity, with columns
+          status:   'succeeded', 'retried' (succeeded after retries) or 'failed'
+          attempts: number of requests sent for the entity's chunk
+          error:    response for failed chunks
+        """
+        chunks = _chunk_by_size(attr_list, max_bytes=max_bytes)
+        attempts = [0]*len(chunks)
+        def post(k):
+            attempts[k] += 1
+            r = _batch_update_entities(self.namespace, self.workspace, chunks[k])
+            if r.status_code!=204:
+                raise requests.HTTPError(r.text, response=r)
+
+        results = parallel_map(post, range(len(chunks)), num_threads=num_threads,
+            max_retries=max_retries, retry_if=_is_retryable, return_exceptions=True, message=message)
+        self.invalidate_entity_cache(etype)
+
+        failed = np.array([isinstance(e, Exception) for e in results], dtype=bool)
+        chunk_df = pd.DataFrame({
+            'status':np.where(np.array(attempts)>1, 'retried', 'succeeded'),
+            'attempts':attempts,
+            'error':[str(e) if f else None for e,f in zip(results, failed)],
+        })
+        chunk_df.loc[failed, 'status'] = 'failed'
+        for k in chunk_df.index[failed]:
+            print('Batch update failed for {} {}s ({} ... {}): {}'.format(
+                len(chunks[k]), etype, chunks[k][0]['name'], chunks[k][-1]['name'], chunk_df.loc[k, 'error']))
+
+        result_df = chunk_df.loc[np.repeat(chunk_df.index, [len(c) for c in chunks])]
+        result_df.index = pd.Index([e['name'] for c in chunks for e in c], name=etype+'_id')
+        return result_df
 
 
     def update_participant_samples(self):
@@ -255,10 +536,22 @@ class WorkspaceManager(object):
         self.update_participant_entities('pair')
 
 
-    def make_pairs(self, sample_set_id=None):
+    def make_pairs(self, sample_set_id=None, normal_types=('Normal',), tumor_types=None,
+                   all_normals=True, pair_id_template='{case_sample}-{control_sample}',
+                   chunk_size=5000, dry_run=False):
         """
         Make all possible pairs from participants (all or a specified set)
         Requires sample_type sample level annotation 'Normal' or 'Tumor'
+
+        normal_types: sample types used as controls
+        tumor_types: sample types used as cases (default: all non-normal types)
+        all_normals: pair each tumor with all normals from the participant
+                     (otherwise only with the participant's first normal)
+        pair_id_template: format string for pair IDs, with fields
+                          case_sample, control_sample, participant
+        chunk_size: maximum number of pairs uploaded per call
+
+        Returns the pairs DataFrame (not uploaded if dry_run is True)
         """
         # get data from sample set or all samples
         if sample_set_id is None:
@@ -266,44 +559,44 @@ class WorkspaceManager(object):
         else:
             df = self.get_sample_attributes_in_set(sample_set_id)
 
-        normal_samples = list(df[df['sample_type'] == 'Normal'].index)
-        participants = list(df['participant'])
-        # generate pairs
-        pair_tumors = list()
-        pair_normals = list()
-        pair_ids = list()
-        participant_pair_ids = list()
-        for s in normal_samples:
-            patient = df['participant'][df.index == s][0]
-            idx = [i for i, x in enumerate(participants) if x == patient]
-            patient_sample_tsv = df.iloc[idx]
-            for i, row in patient_sample_tsv.iterrows():
-                if not row['sample_type'] == 'Normal':
-                    pair_tumors.append(i)
-                    pair_normals.append(s)
-                    pair_ids.append(i + '-' + s)
-                    participant_pair_ids.append(patient)
-        pair_df = pd.DataFrame(
-            np.array([pair_tumors, pair_normals, participant_pair_ids]).T,
-            columns=['case_sample', 'control_sample', 'participant'],
-            index=pair_ids
-        )
+        is_normal = df['sample_type'].isin(normal_types)
+        if tumor_types is None:
+            is_tumor = ~is_normal
+        else:
+            is_tumor = df['sample_type'].isin(tumor_types) & ~is_normal
+        normal_df = pd.DataFrame({'control_sample':df.index[is_normal], 'participant':df.loc[is_normal, 'participant'].values})
+        if not all_normals:
+            normal_df = normal_df.drop_duplicates('participant')
+        tumor_df = pd.DataFrame({'case_sample':df.index[is_tumor], 'participant':df.loc[is_tumor, 'participant'].values})
+
+        # join tumors and normals on participant
+        pair_df = normal_df.merge(tumor_df, on='participant', how='inner')
+        pair_df = pair_df[['case_sample', 'control_sample', 'participant']]
+        pair_df.index = [pair_id_template.format(case_sample=c, control_sample=n, participant=p)
+                         for c,n,p in zip(pair_df['case_sample'], pair_df['control_sample'], pair_df['participant'])]
         pair_df.index.name = 'entity:pair_id'
-        self.upload_entities('pair', pair_df)
+
+        if pair_df.shape[0]==0:
+            print('No pairs found.')
+        elif not dry_run:
+            self.upload_entities('pair', pair_df, chunk_size=chunk_size)
+        return pair_df
 
 
     def update_sample_attributes(self, attrs, sample_id=None):
         """Set or update attributes in attrs (pd.Series or pd.DataFrame)"""
         if sample_id is not None and isinstance(attrs, dict):
-            attrs = pd.DataFrame(attrs, index=[sample_id])
-        self.update_entity_attributes('sample', attrs)
+            attrs = pd.DataFrame([attrs], index=[sample_id])
+        return self.update_entity_attributes('sample', attrs)
 
 
     def update_sample_set_attributes(self, sample_set_id, attrs):
         """
         Set or update attributes in attrs (pd.Series or pd.DataFrame)
         """
-        self.update_entity_attributes('sample_set', attrs)
+        if isinstance(attrs, dict):
+            attrs = pd.DataFrame([attrs], index=[sample_set_id])
+        return self.update_entity_attributes('sample_set', attrs)
 
 
     def delete_sample_set_attributes(self, sample_set_id, attrs):
@@ -332,14 +625,36 @@ class WorkspaceManager(object):
         return attr
 
 
-    def get_sample_attributes_in_set(self, set):
+    def get_sample_attributes_in_set(self, set, samples_df=None, sample_set_df=None):
         """Get sample attributes of samples in a set"""
-        samples = self.get_sample_sets().loc[set]['samples']
-        all_samples = self.get_samples().index
-        idx = np.zeros(len(all_samples), dtype=bool)
-        for s in samples:
-            idx[all_samples == s] = True
-        return self.get_samples()[idx]
+        if samples_df is None:
+            samples_df = self.get_samples()
+        if sample_set_df is None:
+            sample_set_df = self.get_sample_sets()
+        samples = sample_set_df.loc[set, 'samples']
+        return samples_df[samples_df.index.isin(samples)]
+
+
+    def get_sample_attributes_in_sets(self, sample_set_ids=None, samples_df=None, sample_set_df=None):
+        """
+        Get sample attributes of samples in multiple sets (default: all sets)
+
+        Returns a DataFrame indexed by (sample_set_id, sample_id)
+        """
+        if samples_df is None:
+            samples_df = self.get_samples()
+        if sample_set_df is None:
+            sample_set_df = self.get_sample_sets()
+        if sample_set_ids is None:
+            sample_set_ids = sample_set_df.index
+
+        # long-form (sample_set_id, sample_id) membership table
+        members_s = sample_set_df.loc[sample_set_ids, 'samples'].dropna().explode().dropna()
+        members_s = members_s[members_s.isin(samples_df.index)]
+        df = samples_df.loc[members_s.values]
+        df.index = pd.MultiIndex.from_arrays([members_s.index, members_s.values],
+                                             names=['sample_set_id', samples_df.index.name])
+        return df
 
 
     def get_submission_status(self, filter_active=False, config=None, show_namespaces=False):
@@ -373,18 +688,81 @@ class WorkspaceManager(object):
         return df.sort_values('date')[::-1]
 
 
-    def get_workflow_metadata(self, submission_id, workflow_id):
-        """Get metadata JSON for a specific workflow"""
+    def get_workflow_metadata(self, submission_id, workflow_id, include_keys=None):
+        """
+        Get metadata JSON for a specific workflow
+
+        include_keys: only request these keys (matched at any level of the
+                      metadata, e.g. ['executionStatus', 'stderr']) instead of
+                      the full document. Sub-workflows are not expanded.
+
+        If cache_dir is set, metadata of workflows in a terminal state
+        (which no longer changes) is cached on disk. A cached full document
+        is also used for queries with include_keys.
+        """
+        cache_keys = [(submission_id, workflow_id)]
+        if include_keys is not None:
+            # 'status' is needed to determine whether the result can be cached
+            include_keys = sorted(set(include_keys) | {'status'})
+            cache_keys.append((submission_id, workflow_id,
+                hashlib.md5(','.join(include_keys).encode()).hexdigest()))
+        if self._metadata_cache is not None:
+            for k in cache_keys:
+                metadata = self._metadata_cache.get(k)
+                if metadata is not None:
+                    return metadata
+
         metadata = firecloud.api.get_workflow_metadata(self.namespace, self.workspace,
-            submission_id, workflow_id)
-        assert metadata.status_code==200
-        return metadata.json()
+            submission_id, workflow_id, include_key=include_keys, expand_sub_workflows=False)
+        if metadata.status_code!=200:
+            raise requests.HTTPError('Metadata request failed ({}): {}'.format(metadata.status_code, metadata.text),
+                response=metadata)
+        metadata = metadata.json()
+
+        if self._metadata_cache is not None and metadata.get('status') in ['Succeeded', 'Failed', 'Aborted']:
+            self._metadata_cache.set(cache_keys[-1], metadata)
+        return metadata
+
+
+    def get_workflows_metadata(self, status_df, include_keys=None, num_threads=10, max_retries=3):
+        """
+        Get metadata JSON for multiple workflows, using num_threads concurrent
+        requests. Failed requests are retried with exponential backoff, up to
+        max_retries times (server and connection errors only).
+
+        status_df: DataFrame with 'submission_id' and 'workflow_id' columns
+                   (e.g., from get_entity_status)
+        include_keys: see get_workflow_metadata
+
+        Returns a dict of metadata indexed by status_df.index, and a pd.Series
+        of errors for workflows whose metadata could not be fetched
+        """
+        has_id = status_df['workflow_id']!='NA'
+        errors = {i:'No workflow ID' for i in status_df.index[~has_id]}
+        ix = status_df.index[has_id]
+        results = parallel_map(lambda x: self.get_workflow_metadata(*x, include_keys=include_keys),
+            zip(status_df.loc[has_id, 'submission_id'], status_df.loc[has_id, 'workflow_id']),
+            num_threads=num_threads, max_retries=max_retries, retry_if=_is_retryable,
+            return_exceptions=True, message='Fetching metadata')
+
+        metadata_dict = {}
+        for i,r in zip(ix, results):
+            if isinstance(r, Exception):
+                errors[i] = '{}: {}'.format(type(r).__name__, r)
+            else:
+                metadata_dict[i] = r
+        errors = pd.Series(errors, name='error', dtype=object)
+        if len(errors)>0:
+            print('Metadata could not be fetched for {} workflow(s):'.format(len(errors)))
+            print(errors.to_string())
+        return metadata_dict, errors
 
 
     def get_submission(self, submission_id):
         """Get submission metadata"""
         r = firecloud.api.get_submission(self.namespace, self.workspace, submission_id)
-        assert r.status_code==200
+        if r.status_code!=200:
+            raise requests.HTTPError('Submission request failed ({}): {}'.format(r.status_code, r.text), response=r)
         return r.json()
 
 
@@ -416,7 +794,8 @@ class WorkspaceManager(object):
                 print('No workflow ID found for this submission.')
                 return
             workflow_id = s['workflows'][0]['workflowId']
-        metadata = self.get_workflow_metadata(submission_id, workflow_id)
+        metadata = self.get_workflow_metadata(submission_id, workflow_id,
+            include_keys=['shardIndex', 'backendStatus'])
         for task_name in metadata['calls']:
             if np.all(['shardIndex' in i for i in metadata['calls'][task_name]]):
                 print('Submission status ({}): {}'.format(task_name.split('.')[-1], metadata['status']))
@@ -424,41 +803,36 @@ class WorkspaceManager(object):
                 print(s.value_counts().to_string())
 
 
-    def get_entity_status(self, etype, config):
+    def get_entity_status(self, etype, config, num_threads=10):
         """Get status of latest submission for the entity type in the workspace"""
 
         # filter submissions by configuration
         submissions = self.list_submissions(config=config)
-
-        # get status of last run submission
-        entity_dict = {}
-        for k,s in enumerate(submissions):
-            print('\rFetching submission {}/{}'.format(k+1, len(submissions)), end='')
+        for s in submissions:
             if s['submissionEntity']['entityType']!=etype:
-                print('\rIncompatible submission entity type: {}'.format(
+                print('Incompatible submission entity type: {}'.format(
                     s['submissionEntity']['entityType']))
-                print('\rSkipping : '+ s['submissionId'])
-                continue
-            r = self.get_submission(s['submissionId'])
+                print('Skipping : '+ s['submissionId'])
+        submissions = [s for s in submissions if s['submissionEntity']['entityType']==etype]
+
+        # fetch workflows for all submissions
+        responses = parallel_map(lambda s: self.get_submission(s['submissionId']), submissions,
+            num_threads=num_threads, max_retries=3, retry_if=_is_retryable, message='Fetching submission')
+        columns = ['status', 'timestamp', 'workflow_id', 'submission_id', 'configuration']
+        workflows_df = []
+        for s,r in zip(submissions, responses):
             ts = datetime.timestamp(iso8601.parse_date(s['submissionDate']))
-            for w in r['workflows']:
-                entity_id = w['workflowEntity']['entityName']
-                if entity_id not in entity_dict or entity_dict[entity_id]['timestamp']<ts:
-                    entity_dict[entity_id] = {
-                        'status':w['status'],
-                        'timestamp':ts,
-                        'submission_id':s['submissionId'],
-                        'configuration':s['methodConfigurationName']
-                    }
-                    if 'workflowId' in w:
-                        entity_dict[entity_id]['workflow_id'] = w['workflowId']
-                    else:
-                        entity_dict[entity_id]['workflow_id'] = 'NA'
-        print()
-        status_df = pd.DataFrame(entity_dict).T
+            workflows_df.extend([[w['workflowEntity']['entityName'], w['status'], ts,
+                w.get('workflowId', 'NA'), s['submissionId'], s['methodConfigurationName']]
+                for w in r['workflows']])
+        workflows_df = pd.DataFrame(workflows_df, columns=['entity_id']+columns)
+
+        # get status of last run submission
+        status_df = workflows_df.loc[workflows_df.groupby('entity_id')['timestamp'].idxmax()]
+        status_df.set_index('entity_id', inplace=True)
         status_df.index.name = etype+'_id'
 
-        return status_df[['status', 'timestamp', 'workflow_id', 'submission_id', 'configuration']]
+        return status_df[columns]
 
 
     def get_sample_status(self, configuration):
@@ -515,15 +889,15 @@ class WorkspaceManager(object):
             # this doesn't work when multiple successful runs of the same task exist --> need to add this
 
             # for incomplete samples, go through submissions and assign outputs of completed tasks
+            metadata_dict, _ = self.get_workflows_metadata(
+                sample_status_df.loc[sample_status_df.index.intersection(incomplete_df.index)],
+                include_keys=['outputs'])
             task_counts = defaultdict(int)
-            for n,sample_id in enumerate(incomplete_df.index):
-                print('\rPatching attributes for sample {}/{}'.format(n+1, incomplete_df.shape[0]), end='')
-
+            for sample_id,metadata in metadata_dict.items():
                 try:
-                    metadata = self.get_workflow_metadata(sample_status_df.loc[sample_id, 'submission_id'], sample_status_df.loc[sample_id, 'workflow_id'])
                     if 'outputs' in metadata and len(metadata['outputs'])!=0 and not dry_run:
                         attr = {output_map[k.split('.')[-1]]:t for k,t in metadata['outputs'].items()}
-                        self.update_sample_attributes(sample_id, attr)
+                        self.update_sample_attributes(attr, sample_id=sample_id)
                     else:
                         for task in metadata['calls']:
                             if 'outputs' in metadata['calls'][task][-1]:
@@ -533,12 +907,10 @@ class WorkspaceManager(object):
                                         # write to attributes
                                         if not dry_run:
                                             attr = {output_map[i]:j for i,j in metadata['calls'][task][-1]['outputs'].items()}
-                                            self.update_sample_attributes(sample_id, attr)
+                                            self.update_sample_attributes(attr, sample_id=sample_id)
                                         task_counts[task.split('.')[-1]] += 1
-                except:
-                    print('Metadata call failed for sample {}'.format(sample_id))
-                    print(metadata.json())
-            print()
+                except Exception as e:
+                    print('Patching failed for sample {}: {}'.format(sample_id, e))
             for i,j in task_counts.items():
                 print('Samples patched for "{}": {}'.format(i,j))
 
@@ -557,13 +929,12 @@ class WorkspaceManager(object):
             if np.any(error_ix):
                 print('Attributes from {} successful jobs were not written to database.'.format(len(error_ix)))
                 print('Patching attributes with outputs from latest successful run.')
-                for n,sample_set_id in enumerate(incomplete_df.index):
-                    print('\r  * Patching sample set {}/{}'.format(n+1, incomplete_df.shape[0]), end='')
-                    metadata = self.get_workflow_metadata(sample_set_status_df.loc[sample_set_id, 'submission_id'], sample_set_status_df.loc[sample_set_id, 'workflow_id'])
+                metadata_dict, _ = self.get_workflows_metadata(sample_set_status_df.loc[incomplete_df.index],
+                    include_keys=['outputs'])
+                for sample_set_id,metadata in metadata_dict.items():
                     if 'outputs' in metadata and len(metadata['outputs'])!=0 and not dry_run:
                         attr = {output_map[k.split('.')[-1]]:t for k,t in metadata['outputs'].items()}
                         self.update_sample_set_attributes(sample_set_id, attr)
-                print()
         print('Completed patching {} attributes in {}/{}'.format(entity, self.namespace, self.workspace))
 
 
@@ -575,7 +946,8 @@ class WorkspaceManager(object):
         status_df = self.get_sample_status(configuration)
 
         # get workflow details from 1st submission
-        metadata = self.get_workflow_metadata(status_df['submission_id'][0], status_df['workflow_id'][0])
+        metadata = self.get_workflow_metadata(status_df['submission_id'].iloc[0], status_df['workflow_id'].iloc[0],
+            include_keys=['executionStatus'])
 
         workflow_tasks = list(metadata['calls'].keys())
 
@@ -585,12 +957,11 @@ class WorkspaceManager(object):
         else:
             ix = status_df.index
 
-        state_df = pd.DataFrame(0, index=ix, columns=workflow_tasks)
-        for k,i in enumerate(ix):
-            print('\rFetching metadata for sample {}/{}'.format(k+1, len(ix)), end='')
-            metadata = self.get_workflow_metadata(status_df.loc[i, 'submission_id'], status_df.loc[i, 'workflow_id'])
-            state_df.loc[i] = [metadata['calls'][t][-1]['executionStatus'] if t in metadata['calls'] else 'Waiting' for t in workflow_tasks]
-        print()
+        metadata_dict, _ = self.get_workflows_metadata(status_df.loc[ix], include_keys=['executionStatus'])
+        state_df = pd.DataFrame([
+            [metadata_dict[i]['calls'][t][-1]['executionStatus'] if t in metadata_dict[i]['calls'] else 'Waiting' for t in workflow_tasks]
+            if i in metadata_dict else ['Unknown']*len(workflow_tasks) for i in ix
+        ], index=ix, columns=workflow_tasks)
         state_df.rename(columns={i:i.split('.')[1] for i in state_df.columns}, inplace=True)
         summary_df = pd.concat([state_df[c].value_counts() for c in state_df], axis=1).fillna(0).astype(int)
         print(summary_df)
@@ -599,20 +970,30 @@ class WorkspaceManager(object):
         return state_df, summary_df
 
 
-    def get_stderr(self, state_df, task_name):
+    def get_stderr(self, state_df, task_name, tail_kb=None, num_threads=10):
         """
-        Fetch stderrs from bucket (returns list of str)
+        Fetch stderrs of failed tasks from bucket
+
+        state_df: DataFrame returned by display_status
+        tail_kb: only fetch the last tail_kb KB of each log
+
+        Returns a DataFrame indexed by entity, with columns 'stderr_path',
+        'stderr' and 'error' (for logs that could not be fetched)
         """
-        df = state_df[state_df[task_name]==-1]
-        fail_idx = df.index
-        stderrs = []
-        for n,i in enumerate(fail_idx):
-            print('\rFetching stderr for task {}/{}'.format(n+1, len(fail_idx)), end='\r')
-            metadata = self.get_workflow_metadata(state_df.loc[i, 'submission_id'], state_df.loc[i, 'workflow_id'])
-            stderr_path = metadata['calls'][[i for i in metadata['calls'].keys() if i.split('.')[1]==task_name][0]][-1]['stderr']
-            s = subprocess.check_output('gsutil cat '+stderr_path, shell=True).decode()
-            stderrs.append(s)
-        return stderrs
+        fail_idx = state_df.index[state_df[task_name]=='Failed']
+
+        def fetch_stderr(i):
+            metadata = self.get_workflow_metadata(state_df.loc[i, 'submission_id'], state_df.loc[i, 'workflow_id'],
+                include_keys=['stderr'])
+            stderr_path = metadata['calls'][[t for t in metadata['calls'].keys() if t.split('.')[1]==task_name][0]][-1]['stderr']
+            return stderr_path, gs_cat(stderr_path, tail_bytes=None if tail_kb is None else tail_kb*1024)
+
+        results = parallel_map(fetch_stderr, fail_idx, num_threads=num_threads, max_retries=3,
+            retry_if=_is_retryable, return_exceptions=True, message='Fetching stderr for task')
+        stderr_df = pd.DataFrame([[np.nan, np.nan, '{}: {}'.format(type(r).__name__, r)] if isinstance(r, Exception)
+            else [r[0], r[1], np.nan] for r in results],
+            index=fail_idx, columns=['stderr_path', 'stderr', 'error'])
+        return stderr_df
 
 
     def get_submission_history(self, sample_id, config=None):
@@ -648,108 +1029,222 @@ class WorkspaceManager(object):
         return outputs_df
 
 
-    def get_storage(self):
+    def get_bucket_inventory(self, max_age=0, full=False):
+        """
+        Get inventory of the files in the workspace bucket (see BucketInventory).
+        If cache_dir is set, the inventory is stored on disk.
+
+        The inventory is refreshed if it is older than max_age seconds
+        (None: never). Refreshes are incremental: only the directories of
+        submissions that were created or still running since the last
+        refresh are listed again, unless full=True (or on first use).
+        Files outside of submission directories are only updated by
+        full refreshes.
+        """
+        if self._bucket_inventory is None:
+            index_path = None
+            if self.cache_dir is not None:
+                index_path = os.path.join(self.cache_dir, self.namespace, self.workspace, 'bucket_inventory.pkl')
+            self._bucket_inventory = BucketInventory(self.get_bucket_id(), index_path=index_path)
+        inventory = self._bucket_inventory
+
+        if full or inventory.last_refresh is None:
+            submissions = self.list_submissions()
+            inventory.refresh()
+        elif max_age is not None and time.time()-inventory.last_refresh >= max_age:
+            submissions = self.list_submissions()
+            status = inventory.metadata.get('submissions', {})
+            inventory.refresh([s['submissionId']+'/' for s in submissions
+                if status.get(s['submissionId']) not in ['Done', 'Aborted']])
+        else:
+            return inventory
+        inventory.metadata['submissions'] = {s['submissionId']:s['status'] for s in submissions}
+        inventory.save()
+        return inventory
+
+
+    def get_bucket_listing(self, max_age=0):
+        """
+        Get listing of all files in the workspace bucket (see gs_list_df),
+        from the bucket inventory (see get_bucket_inventory)
+        """
+        return self.get_bucket_inventory(max_age=max_age).listing_df
+
+
+    def get_submission_storage(self, max_age=0):
+        """
+        Get storage used by each submission (in bytes), from the bucket inventory
+        """
+        size_s = self.get_bucket_inventory(max_age=max_age).size_by_prefix(depth=1)
+        submissions = self.list_submissions()
+        df = pd.DataFrame([[s['submissionId'], s['methodConfigurationName'], s['status'], s['submissionDate']]
+            for s in submissions], columns=['submission_id', 'configuration', 'status', 'date']).set_index('submission_id')
+        df['size_bytes'] = size_s.reindex(df.index).fillna(0).astype(np.int64)
+        return df.sort_values('size_bytes', ascending=False)
+
+
+    def get_unreferenced_files(self, referenced_paths=None, prefix='', max_age=0):
+        """
+        Get files in the bucket (under prefix) that are not referenced by
+        workspace or entity attributes, from the bucket inventory.
+
+        Returns a DataFrame of files, with their extension and submission ID
+        (NaN for files outside of submission directories)
+        """
+        if referenced_paths is None:
+            referenced_paths = self.get_referenced_paths()
+        inventory = self.get_bucket_inventory(max_age=max_age)
+        df = inventory.unreferenced(referenced_paths, prefix=prefix).copy()
+        path_s = df['path'].str.slice(len(inventory.root))
+        submission_ids = path_s.str.split('/', n=1).str[0]
+        df['submission_id'] = submission_ids.where(submission_ids.isin(list(inventory.metadata.get('submissions', {}))))
+        df['extension'] = path_s.str.rsplit('/', n=1).str[-1].str.split('.', n=1).str[1]
+        return df
+
+
+    def purge_unreferenced_files(self, extensions=None, submission_ids=None, prefix='',
+                                 referenced_paths=None, include_non_submission=False,
+                                 max_age=0, dry_run=False, num_threads=10):
+        """
+        Delete files that are not referenced by workspace or entity attributes
+        (see get_unreferenced_files), optionally restricted to extensions
+        and submissions.
+
+        Only files in submission directories are deleted, unless
+        include_non_submission=True (e.g., notebooks and uploaded files).
+
+        Returns the DataFrame of files that were (or, if dry_run, would be) deleted
+        """
+        purge_df = self.get_unreferenced_files(referenced_paths=referenced_paths, prefix=prefix, max_age=max_age)
+        if not include_non_submission:
+            purge_df = purge_df[purge_df['submission_id'].notnull()]
+        if extensions is not None:
+            purge_df = purge_df[purge_df['extension'].isin(extensions)]
+        if submission_ids is not None:
+            purge_df = purge_df[purge_df['submission_id'].isin(submission_ids)]
+        if len(purge_df)==0:
+            print('No unreferenced files to purge.')
+            return purge_df
+
+        summary_df = purge_df.groupby(['extension', 'submission_id'], dropna=False)['size'].agg(['count', 'sum'])
+        summary_df.columns = ['files', 'size_bytes']
+        print(summary_df.sort_values('size_bytes', ascending=False).to_string())
+        if dry_run:
+            return purge_df
+
+        while True:
+            s = input('{} unreferenced files ({:.2f} GB) found. Delete? [y/n] '.format(
+                len(purge_df), purge_df['size'].sum()/1024**3)).lower()
+            if s=='n' or s=='y':
+                break
+        if s=='y':
+            print('Purging {} unreferenced files.'.format(len(purge_df)))
+            gs_delete(purge_df['path'].tolist(), chunk_size=500, num_threads=num_threads)
+            self._bucket_inventory.remove(purge_df['path'])
+            self._bucket_inventory.save()
+        return purge_df
+
+
+    def get_entity_types(self):
+        """Get list of entity types in the workspace"""
+        r = firecloud.api.list_entity_types(self.namespace, self.workspace)
+        assert r.status_code==200
+        return list(r.json().keys())
+
+
+    def get_referenced_paths(self):
+        """
+        Get set of gs:// paths referenced by workspace attributes and
+        attributes of all entity types
+        """
+        paths = _get_gs_paths(self.get_attributes().values())
+        for etype in self.get_entity_types():
+            paths.update(_get_gs_paths(self.get_entities(etype).values.ravel()))
+        return paths
+
+
+    def get_storage(self, max_age=None):
         """
         Get total amount of storage used, in TB
 
+        max_age: if set, use the bucket inventory (see get_bucket_inventory)
+
         Pricing: $0.026/GB/month (multi-regional)
                  $0.02/GB/month (regional)
         """
+        if max_age is not None:
+            return np.float64(self.get_bucket_inventory(max_age=max_age).size())/1024**4
         bucket_id = self.get_bucket_id()
-        s = subprocess.check_output('gsutil du -s gs://'+bucket_id, shell=True)
-        return np.float64(s.decode().split()[0])/1024**4
+        return np.float64(gs_du('gs://{}/'.format(bucket_id)))/1024**4
 
 
-    def get_stats(self, status_df, workflow_name=None):
+    def get_stats(self, status_df, workflow_name=None, region=None):
         """
         For a list of submissions, calculate time, preemptions, etc
+
+        region: region for VM prices (see VMPricing)
         """
         # for successful jobs, get metadata and count attempts
         status_df = status_df[status_df['status']=='Succeeded'].copy()
-        metadata_dict = {}
-        for k,(i,row) in enumerate(status_df.iterrows()):
-            print('\rFetching metadata {}/{}'.format(k+1,status_df.shape[0]), end='')
-            fetch = True
-            while fetch:  # improperly dealing with 500s here...
-                try:
-                    metadata = self.get_workflow_metadata(row['submission_id'], row['workflow_id'])
-                    metadata_dict[i] = metadata.json()
-                    fetch = False
-                except:
-                    pass
+        metadata_dict, _ = self.get_workflows_metadata(status_df)
+        status_df = status_df[status_df.index.isin(list(metadata_dict.keys()))]
 
         # if workflow_name is None:
             # split output by workflow
-        workflows = np.array([metadata_dict[k]['workflowName'] for k in metadata_dict])
+        workflows = np.array([metadata_dict[k]['workflowName'] for k in status_df.index])
         # else:
             # workflows = np.array([workflow_name])
 
+        # flatten metadata into a table of call attempts
+        attempts_df = _get_call_attempts(metadata_dict)
+
         # get tasks for each workflow
         for w in np.unique(workflows):
-            workflow_status_df = status_df[workflows==w]
+            workflow_status_df = status_df[workflows==w].copy()
             tasks = np.sort(list(metadata_dict[workflow_status_df.index[0]]['calls'].keys()))
-            task_names = [t.rsplit('.')[-1] for t in tasks]
-
-            task_dfs = {}
-            for t in tasks:
-                task_name = t.rsplit('.')[-1]
-                task_dfs[task_name] = pd.DataFrame(index=workflow_status_df.index,
-                    columns=[
-                        'time_h',
-                        'total_time_h',
-                        'max_preempt_time_h',
-                        'machine_type',
-                        'attempts',
-                        'start_time',
-                        'est_cost',
-                        'job_ids'])
-                for i in workflow_status_df.index:
-                    successes = {}
-                    preemptions = []
-
-                    if 'shardIndex' in metadata_dict[i]['calls'][t][0]:
-                        scatter = True
-                        for j in metadata_dict[i]['calls'][t]:
-                            if j['shardIndex'] in successes:
-                                preemptions.append(j)
-                            # last shard (assume success follows preemptions)
-                            successes[j['shardIndex']] = j
-                    else:
-                        scatter = False
-                        successes[0] = metadata_dict[i]['calls'][t][-1]
-                        preemptions = metadata_dict[i]['calls'][t][:-1]
-
-                    task_dfs[task_name].loc[i, 'time_h'] = np.sum([workflow_time(j)/3600 for j in successes.values()])
-
-                    # subtract time spent waiting for quota
-                    quota_time = [e for m in successes.values() for e in m['executionEvents'] if e['description']=='waiting for quota']
-                    quota_time = [(convert_time(q['endTime']) - convert_time(q['startTime']))/3600 for q in quota_time]
-                    task_dfs[task_name].loc[i, 'time_h'] -= np.sum(quota_time)
-
-                    total_time_h = [workflow_time(t_attempt)/3600 for t_attempt in metadata_dict[i]['calls'][t]]
-                    task_dfs[task_name].loc[i, 'total_time_h'] = np.sum(total_time_h) - np.sum(quota_time)
-
-                    if not np.any(['hit' in j['callCaching'] and j['callCaching']['hit'] for j in metadata_dict[i]['calls'][t]]):
-                        was_preemptible = [j['preemptible'] for j in metadata_dict[i]['calls'][t]]
-                        if len(preemptions)>0:
-                            assert was_preemptible[0]
-                            task_dfs[task_name].loc[i, 'max_preempt_time_h'] = np.max([workflow_time(t_attempt) for t_attempt in preemptions])/3600
-                        task_dfs[task_name].loc[i, 'attempts'] = len(metadata_dict[i]['calls'][t])
-
-                        task_dfs[task_name].loc[i, 'start_time'] = iso8601.parse_date(metadata_dict[i]['calls'][t][0]['start']).astimezone(pytz.timezone(self.timezone)).strftime('%H:%M')
-
-                        machine_types = [j['jes']['machineType'].rsplit('/')[-1] for j in metadata_dict[i]['calls'][t]]
-                        task_dfs[task_name].loc[i, 'machine_type'] = machine_types[-1]  # use last instance
-
-                        task_dfs[task_name].loc[i, 'est_cost'] = np.sum([get_vm_cost(m,p)*h for h,m,p in zip(total_time_h, machine_types, was_preemptible)])
-
-                        task_dfs[task_name].loc[i, 'job_ids'] = ','.join([j['jobId'] for j in successes.values()])
+            df = attempts_df[attempts_df['entity'].isin(workflow_status_df.index) & attempts_df['task'].isin(tasks)]
+            keys = [df['task'], df['entity']]
+
+            # subtract time spent waiting for quota
+            quota_h = df['quota_h'].where(df['success'], 0)
+            # only report details for tasks without call cache hits
+            call_cached = df['call_cache_hit'].groupby(keys).transform('any').astype(bool)
+            was_preempted = ~df['success'] & ~call_cached
+            # first attempts of preempted shards must have been preemptible
+            assert np.all(df.loc[was_preempted.groupby(keys+[df['shard']]).transform('any').astype(bool) & (df['attempt']==0), 'preemptible'])
+
+            # cost per attempt
+            vm_cost = get_vm_pricing().get_cost(df['machine_type'].where(~call_cached).values, df['preemptible'].values,
+                region=region)
+            # costs are unknown if any attempt could not be priced
+            unpriced = pd.Series(np.isnan(vm_cost), index=df.index) & ~call_cached
+
+            success_df = df[df['success']].sort_values('shard', kind='mergesort')
+            stats_df = pd.DataFrame({
+                'time_h': (df['time_h'].where(df['success'], 0) - quota_h).groupby(keys).sum(),
+                'total_time_h': (df['time_h'] - quota_h).groupby(keys).sum(),
+                'max_preempt_time_h': df['time_h'].where(was_preempted).groupby(keys).max(),
+                'machine_type': df['machine_type'].where(~call_cached).groupby(keys).last(),
+                'attempts': df['attempt'].where(~call_cached).groupby(keys).count(),
+                'start_time': df['start'].where(~call_cached).groupby(keys).first().dt.tz_convert(self.timezone).dt.strftime('%H:%M'),
+                'est_cost': (df['time_h']*vm_cost).where(~call_cached).groupby(keys).sum(min_count=1).mask(
+                    unpriced.groupby(keys).any()),
+                'job_ids': success_df['job_id'].where(~call_cached).groupby([success_df['task'], success_df['entity']]).agg(
+                    lambda x: ','.join(x) if x.notnull().all() else np.nan),
+            })
+            stats_df.loc[stats_df['attempts']==0, 'attempts'] = np.nan
+            task_dfs = {t.rsplit('.')[-1]:stats_df.loc[t].reindex(workflow_status_df.index) for t in tasks}
 
             # add overall cost
-            workflow_status_df['est_cost'] = pd.concat([task_dfs[t.rsplit('.')[-1]]['est_cost'] for t in tasks], axis=1).sum(axis=1)
-            workflow_status_df['time_h'] = [workflow_time(metadata_dict[i])/3600 for i in workflow_status_df.index]
-            workflow_status_df['cpu_hours'] = pd.concat([task_dfs[t.rsplit('.')[-1]]['total_time_h'] * task_dfs[t.rsplit('.')[-1]]['machine_type'].apply(lambda i: int(i.rsplit('-',1)[-1]) if (pd.notnull(i) and '-small' not in i and '-micro' not in i) else 1) for t in tasks], axis=1).sum(axis=1)
-            workflow_status_df['start_time'] = [iso8601.parse_date(metadata_dict[i]['start']).astimezone(pytz.timezone(self.timezone)).strftime('%H:%M') for i in workflow_status_df.index]
+            workflow_status_df['est_cost'] = stats_df['est_cost'].groupby(level=1).sum().mask(
+                unpriced.groupby(df['entity']).any()).reindex(workflow_status_df.index)
+            workflow_start = parse_timestamps([metadata_dict[i]['start'] for i in workflow_status_df.index])
+            workflow_end = parse_timestamps([metadata_dict[i].get('end') for i in workflow_status_df.index])
+            workflow_status_df['time_h'] = (workflow_end - workflow_start).dt.total_seconds().values/3600
+            # CPUs from machine type (e.g., n1-standard-4)
+            cpus = get_vm_cpus(stats_df['machine_type'])
+            workflow_status_df['cpu_hours'] = (stats_df['total_time_h'] * cpus).groupby(level=1).sum().reindex(workflow_status_df.index)
+            workflow_status_df['start_time'] = workflow_start.dt.tz_convert(self.timezone).dt.strftime('%H:%M').values
 
         return workflow_status_df, task_dfs
 
@@ -760,13 +1255,14 @@ class WorkspaceManager(object):
         r = get_config(to_cnamespace, to_config)
         old_version = None
         if r:
-            old_version = np.max([m['snapshotId'] for m in r])
+            old_version = r[-1]['snapshotId']
             print('Configuration {}/{} exists. SnapshotID: {}'.format(
                 to_cnamespace, to_config, old_version))
 
         # copy config to repo
         r = firecloud.api.copy_config_to_repo(self.namespace, self.workspace,
                 from_cnamespace, from_config, to_cnamespace, to_config)
+        invalidate_repository_cache()
         assert r.status_code==200
         print("Successfully copied {}/{}. New SnapshotID: {}".format(to_cnamespace, to_config, r.json()['snapshotId']))
 
@@ -779,6 +1275,7 @@ class WorkspaceManager(object):
         # delete old version
         if old_version is not None:
             r = firecloud.api.delete_repository_config(to_cnamespace, to_config, old_version)
+            invalidate_repository_cache()
             assert r.status_code==200
             print("Successfully deleted SnapshotID {}.".format(old_version))
 
@@ -789,7 +1286,7 @@ class WorkspaceManager(object):
         c = get_config(cnamespace, cname)
         if len(c)==0:
             raise ValueError('Configuration "{}/{}" not found (name must match exactly).'.format(cnamespace, cname))
-        c = c[np.argmax([i['snapshotId'] for i in c])]
+        c = c[-1]
         r = firecloud.api.copy_config_from_repo(self.namespace, self.workspace,
             cnamespace, cname, c['snapshotId'], cnamespace, cname)
         if r.status_code==201:
@@ -809,60 +1306,116 @@ class WorkspaceManager(object):
             return r.json()
         else:
             print(r.text)
+            raise ValueError('Query for page {} of {}s failed.'.format(page, etype))
+
+
+    def _entity_cache_path(self, etype):
+        return os.path.join(self.cache_dir, self.namespace, self.workspace,
+                            'entities', etype+'.pkl')
+
+
+    def _get_cached_entities(self, etype):
+        """Return cached entity table if present and not expired, otherwise None"""
+        if self.cache_ttl==0:
+            return None
+        if etype in self._entity_cache:
+            ts, df = self._entity_cache[etype]
+            if self.cache_ttl is None or time.time()-ts < self.cache_ttl:
+                return df
+            self._entity_cache.pop(etype)
+        if self.cache_dir is not None:
+            path = self._entity_cache_path(etype)
+            if os.path.exists(path):
+                ts = os.path.getmtime(path)
+                if self.cache_ttl is None or time.time()-ts < self.cache_ttl:
+                    df = pd.read_pickle(path)
+                    self._entity_cache[etype] = (ts, df)
+                    return df
+        return None
+
+
+    def _cache_entities(self, etype, df):
+        if self.cache_ttl==0:
+            return
+        self._entity_cache[etype] = (time.time(), df)
+        if self.cache_dir is not None:
+            path = self._entity_cache_path(etype)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+            df.to_pickle(tmp_path)
+            os.replace(tmp_path, path)
+
+
+    def invalidate_entity_cache(self, etype=None):
+        """Remove cached entity table(s) for etype (default: all types)"""
+        if etype is None:
+            etypes = list(self._entity_cache)
+            if self.cache_dir is not None:
+                cache_dir = os.path.dirname(self._entity_cache_path(''))
+                if os.path.isdir(cache_dir):
+                    etypes += [i[:-4] for i in os.listdir(cache_dir) if i.endswith('.pkl')]
+        else:
+            etypes = [etype]
+        for i in set(etypes):
+            self._entity_cache.pop(i, None)
+            if self.cache_dir is not None and os.path.exists(self._entity_cache_path(i)):
+                os.remove(self._entity_cache_path(i))
 
 
-    def get_entities(self, etype, page_size=1000):
-        """Paginated query replacing get_entities_tsv()"""
+    def get_entities(self, etype, page_size=1000, num_threads=10, max_retries=3, use_cache=True):
+        """
+        Paginated query replacing get_entities_tsv()
+
+        Pages 2..N are fetched concurrently (num_threads); failed pages
+        are retried individually up to max_retries times. List attributes
+        are returned as lists, and entity references as entity names.
+
+        If caching is enabled (see cache_ttl), a cached copy of the table is
+        returned unless use_cache is False.
+        """
+        if use_cache:
+            df = self._get_cached_entities(etype)
+            if df is not None:
+                return df.copy()
+
         # get first page
-        r = self._get_entities_query(etype, 1, page_size=page_size)
+        r = call_with_retry(self._get_entities_query, etype, 1,
+                page_size=page_size, max_retries=max_retries)
 
-        # get additional pages
+        # get additional pages; each page is decoded as soon as it arrives
         total_pages = r['resultMetadata']['filteredPageCount']
-        all_entities = r['results']
-        for page in range(2,total_pages+1):
-            r = self._get_entities_query(etype, page, page_size=page_size)
-            all_entities.extend(r['results'])
-
-        # convert to DataFrame
-        df = pd.DataFrame({i['name']:i['attributes'] for i in all_entities}).T
+        pages = [_decode_entities(r['results'])]
+        del r
+        pages.extend(parallel_map(lambda p: _decode_entities(self._get_entities_query(etype, p, page_size=page_size)['results']),
+                range(2,total_pages+1), num_threads=num_threads, max_retries=max_retries))
+
+        df = pd.concat(pages, axis=0, sort=False)
+        # only infer types of complete columns (integers with missing values would become floats)
+        complete = df.columns[df.notnull().all().values]
+        df = df.astype({c:df[c].infer_objects().dtype for c in complete})
         df.index.name = etype+'_id'
-        # convert JSON to lists; assumes that values are stored in 'items'
-        df = df.applymap(lambda x: x['items'] if isinstance(x, dict) and 'items' in x else x)
-        return df
+        self._cache_entities(etype, df)
+        return df.copy() if self.cache_ttl!=0 else df
 
 
     def get_samples(self):
         """Get DataFrame with samples and their attributes"""
-        df = self.get_entities('sample')
-        df['participant'] = df['participant'].apply(lambda x: x['entityName'])
-        return df
+        return self.get_entities('sample')
 
 
     def get_pairs(self):
         """Get DataFrame with pairs and their attributes"""
-        df = self.get_entities('pair')
-        df['participant'] = df['participant'].apply(lambda x: x['entityName'])
-        df['case_sample'] = df['case_sample'].apply(lambda  x: x['entityName'])
-        df['control_sample'] = df['control_sample'].apply(lambda x: x['entityName'])
-        return df
+        return self.get_entities('pair')
 
 
     def get_participants(self):
         """Get DataFrame with participants and their attributes"""
-        df = self.get_entities('participant')
-        # convert sample lists from JSON
-        df = df.applymap(lambda x: [i['entityName'] if 'entityName' in i else i for i in x]
-                            if np.all(pd.notnull(x)) and isinstance(x, list) else x)
-        return df
+        return self.get_entities('participant')
 
 
     def get_sample_sets(self):
         """Get DataFrame with sample sets and their attributes"""
-        df = self.get_entities('sample_set')
-        # convert sample lists from JSON
-        df = df.applymap(lambda x: [i['entityName'] if 'entityName' in i else i for i in x]
-                            if np.all(pd.notnull(x)) and isinstance(x, list) else x)
-        return df
+        return self.get_entities('sample_set')
 
 
     #-------------------------------------------------------------------------
@@ -882,6 +1435,7 @@ class WorkspaceManager(object):
                 'op': 'AddUpdateAttribute'
             }]
             r = firecloud.api.update_entity(self.namespace, self.workspace, etype+'_set', set_id, attrs)
+            self.invalidate_entity_cache(etype+'_set')
             if r.status_code==200:
                 print('{} set "{}" ({} {}s) successfully updated.'.format(
                     etype.capitalize(), set_id, len(entity_ids), etype))
@@ -931,6 +1485,7 @@ class WorkspaceManager(object):
         }
         attrs = [firecloud.api._attr_set(i,j) for i,j in attr_dict.items()]
         r = firecloud.api.update_entity(self.namespace, self.workspace, 'sample_set', super_set_id, attrs)
+        self.invalidate_entity_cache('sample_set')
         if r.status_code==200:
             print('Set of sample sets "{}" successfully created.'.format(super_set_id))
         else:
@@ -953,6 +1508,8 @@ class WorkspaceManager(object):
           To delete multiple attributes a single sample:
             wm.delete_entity_attributes('sample', attributes_list, entity_id=sample_id)
 
+        Returns a DataFrame with the status of each entity (see update_entity_attributes)
+
         WARNING: This action is not reversible. Be careful!
         """
         assert isinstance(attrs, (list, pd.Series, pd.DataFrame))
@@ -969,18 +1526,20 @@ class WorkspaceManager(object):
                 gs_delete(file_list)
 
         if isinstance(attrs, pd.DataFrame):  # delete index x column combinations
+            operations = [{'attributeName':c, 'op':'RemoveAttribute'} for c in attrs]
             attr_list = [{
                 'name':i,
                 'entityType':etype,
-                'operations':[{'attributeName':c, 'op':'RemoveAttribute'} for c in attrs]
+                'operations':operations
             } for i in attrs.index]
             msg = "Successfully deleted attributes {} for {} {}s.".format(attrs.columns, attrs.shape[0], et)
         elif isinstance(attrs, pd.Series) and attrs.name is not None:  # delete index x attr.name
             # assume attrs.name is attribute name
+            operations = [{'attributeName':attrs.name, 'op':'RemoveAttribute'}]
             attr_list = [{
                 'name':i,
                 'entityType':etype,
-                'operations':[{'attributeName':attrs.name, 'op':'RemoveAttribute'}]
+                'operations':operations
             } for i in attrs.index]
             msg = "Successfully deleted attribute {} for {} {}s.".format(attrs.name, attrs.shape[0], et)
         elif isinstance(attrs, list) and entity_id is not None:
@@ -993,42 +1552,37 @@ class WorkspaceManager(object):
         else:
             raise ValueError('Input type is not supported.')
 
-        # TODO: try
-        r = _batch_update_entities(self.namespace, self.workspace, attr_list)
-        if r.status_code==204:
+        result_df = self._batch_update(etype, attr_list)
+        n_failed = np.sum(result_df['status']=='failed')
+        if n_failed==0:
             print(msg)
         else:
-            print(r.text)
-        # except:  # rawls API not available
-        #     if isinstance(attrs, str):
-        #         rm_list = [{"op": "RemoveAttribute", "attributeName": attrs}]
-        #     elif isinstance(attrs, Iterable):
-        #         rm_list = [{"op": "RemoveAttribute", "attributeName": i} for i in attrs]
-        #     r = firecloud.api.update_entity(self.namespace, self.workspace, etype, ename, rm_list)
-        #         assert r.status_code==200
+            print('Deletion failed for {} of {} {}s.'.format(n_failed, len(attr_list), etype))
+        return result_df
 
 
     def delete_sample_attributes(self, attrs, entity_id=None, delete_files=False, dry_run=False):
         """Delete sample attributes and (optionally) their associated data"""
-        self.delete_entity_attributes('sample', attrs,
+        return self.delete_entity_attributes('sample', attrs,
                 entity_id=entity_id, delete_files=delete_files, dry_run=dry_run)
 
 
     def delete_sample_set_attributes(self, attrs, entity_id=None, delete_files=False, dry_run=False):
         """Delete sample set attributes and (optionally) their associated data"""
-        self.delete_entity_attributes('sample_set', attrs,
+        return self.delete_entity_attributes('sample_set', attrs,
                 entity_id=entity_id, delete_files=delete_files, dry_run=dry_run)
 
 
     def delete_participant_attributes(self, attrs, entity_id=None, delete_files=False, dry_run=False):
         """Delete participant attributes and (optionally) their associated data"""
-        self.delete_entity_attributes('participant', attrs,
+        return self.delete_entity_attributes('participant', attrs,
                 entity_id=entity_id, delete_files=delete_files, dry_run=dry_run)
 
 
     def delete_entity(self, etype, entity_ids):
         """Delete entity or list of entities"""
         r = firecloud.api.delete_entity_type(self.namespace, self.workspace, etype, entity_ids)
+        self.invalidate_entity_cache(etype)
         if r.status_code==204:
             print('{}(s) {} successfully deleted.'.format(etype.replace('_set', ' set').capitalize(), entity_ids))
         else:
@@ -1048,6 +1602,7 @@ class WorkspaceManager(object):
     def delete_participant(self, participant_ids, delete_dependencies=False):
         """Delete participant or list of participants"""
         r = firecloud.api.delete_entity_type(self.namespace, self.workspace, 'participant', participant_ids)
+        self.invalidate_entity_cache()  # dependent entities may be deleted
         if r.status_code==204:
             print('Participant(s) {} successfully deleted.'.format(participant_ids))
         elif r.status_code==409:
@@ -1089,7 +1644,7 @@ class WorkspaceManager(object):
         Delete outdated files matching attribute (e.g., from prior/outdated runs)
         """
         if bucket_files is None:
-            bucket_files = gs_list_bucket_files(self.get_bucket_id())
+            bucket_files = self.get_bucket_listing()['path'].tolist()
 
         if samples_df is None:
             samples_df = self.get_samples()
@@ -1107,7 +1662,8 @@ class WorkspaceManager(object):
             assert len(ext)==1
             ext = ext[0]
 
-        purge_paths = [i for i in bucket_files if i.endswith(ext) and i not in set(samples_df[attribute])]
+        current_paths = set(samples_df[attribute])
+        purge_paths = [i for i in bucket_files if i.endswith(ext) and i not in current_paths]
         if len(purge_paths)==0:
             print('No outdated files to purge.')
         else:
@@ -1122,9 +1678,12 @@ class WorkspaceManager(object):
             if s=='y':
                 print('Purging {} outdated files.'.format(len(purge_paths)))
                 gs_delete(purge_paths, chunk_size=500)
+                if self._bucket_inventory is not None:
+                    self._bucket_inventory.remove(purge_paths)
+                    self._bucket_inventory.save()
 
 
-    def update_entity_attributes(self, etype, attrs):
+    def update_entity_attributes(self, etype, attrs, diff=False, current_df=None):
         """
         Create or update entity attributes
 
@@ -1138,43 +1697,53 @@ class WorkspaceManager(object):
 
           To update a single attribute for a single entity, use:
             pd.Series({attr_name:attr_value}, name=entity_name)
+
+        Updates are sent in concurrent, size-bounded batches. Returns a
+        DataFrame with the status of each entity ('succeeded', 'retried', 'failed').
+
+        diff: only send values that differ from the current entity attributes
+              (current_df, or fetched with get_entities). Null values
+              remove the attribute. Entities without changes are reported
+              as 'unchanged', and the number of skipped values per entity
+              is returned in the 'skipped' column.
         """
-        if isinstance(attrs, pd.DataFrame):
-            attr_list = []
-            for i,row in attrs.iterrows():
-                attr_list.extend([{
-                    'name':row.name,
-                    'entityType':etype,
-                    'operations': [{"op": "AddUpdateAttribute", "attributeName": i, "addUpdateAttribute":str(j)} for i,j in row.iteritems()]
-                }])
+        if diff:
+            if current_df is None:
+                current_df = self.get_entities(etype)
+            attr_list, skipped_s = _diff_operations(etype,
+                attrs.to_frame() if isinstance(attrs, pd.Series) else attrs, current_df)
+            print('Skipping {} unchanged values.'.format(skipped_s.sum()))
+        elif isinstance(attrs, pd.DataFrame):
+            columns = attrs.columns.tolist()
+            attr_list = [{
+                'name':i,
+                'entityType':etype,
+                'operations': [{"op": "AddUpdateAttribute", "attributeName":c, "addUpdateAttribute":str(j)} for c,j in zip(columns, row)]
+            } for i,row in zip(attrs.index, attrs.values.tolist())]
         elif isinstance(attrs, pd.Series):
             attr_list = [{
                 'name':i,
                 'entityType':etype,
                 'operations': [{"op": "AddUpdateAttribute", "attributeName":attrs.name, "addUpdateAttribute":str(j)}]
-            } for i,j in attrs.iteritems()]
+            } for i,j in zip(attrs.index, attrs.values.tolist())]
         else:
             raise ValueError('Unsupported input format.')
 
-        # try rawls batch call if available
-        r = _batch_update_entities(self.namespace, self.workspace, attr_list)
-        # try:  # TODO
-        if r.status_code==204:
-            if isinstance(attrs, pd.DataFrame):
-                print("Successfully updated attributes '{}' for {} {}s.".format(attrs.columns.tolist(), attrs.shape[0], etype))
-            elif isinstance(attrs, pd.Series):
-                print("Successfully updated attribute '{}' for {} {}s.".format(attrs.name, len(attrs), etype))
-            else:
-                print("Successfully updated attribute '{}' for {} {}s.".format(attrs.name, len(attrs), etype))
+        result_df = self._batch_update(etype, attr_list)
+        if diff:
+            result_df = result_df.reindex(attrs.index)
+            result_df['status'] = result_df['status'].fillna('unchanged')
+            result_df['attempts'] = result_df['attempts'].fillna(0).astype(int)
+            result_df['skipped'] = skipped_s
+            result_df.index.name = etype+'_id'
+        n_updated = np.sum(result_df['status'].isin(['succeeded', 'retried']))
+        if isinstance(attrs, pd.DataFrame):
+            print("Successfully updated attributes '{}' for {} {}s.".format(attrs.columns.tolist(), n_updated, etype))
         else:
-            print(r.text)
-        # except:  # revert to public API
-        #     attrs = [firecloud.api._attr_set(i,j) for i,j in attr_dict.items()]
-        #     r = firecloud.api.update_entity(self.namespace, self.workspace, etype, ename, attrs)
-        #     if r.status_code==200:
-        #         print('Successfully updated {}.'.format(ename))
-        #     else:
-        #         print(r.text)
+            print("Successfully updated attribute '{}' for {} {}s.".format(attrs.name, n_updated, etype))
+        if n_updated<len(attr_list):
+            print("Update failed for {} of {} {}s.".format(len(attr_list)-n_updated, len(attr_list), etype))
+        return result_df
 
 
     def update_configuration(self, json_body):
@@ -23,6 +23,7 @@ setup(
             'dalmatian = dalmatian.core:main'
         ]
     },
+    python_requires = '>=3.5',
     install_requires = [
     'numpy',
     'matplotlib',
@@ -33,7 +34,6 @@ setup(
     'iso8601'
     ],
     classifiers = [
-        "Programming Language :: Python :: 2",
         "Programming Language :: Python :: 3",
         "Intended Audience :: Science/Research",
         "Topic :: Scientific/Engineering :: Bio-Informatics",
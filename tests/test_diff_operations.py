@@ -0,0 +1,18 @@
+import numpy as np
+import pandas as pd
+from dalmatian.wmanager import _diff_operations
+
+
+def test_diff_operations():
+    current_df = pd.DataFrame({'id': ['0123', '1e3', 'a'], 'n': [1, 2**53, 3],
+                               'flag': [True, False, True]}, index=['s1', 's2', 's3'])
+    attrs = pd.DataFrame({'id': ['123', '1000', 'a'], 'n': [1.0, 2**53+1, 3],
+                          'flag': ['true', 'true', np.nan]}, index=['s1', 's2', 's3'], dtype=object)
+    attr_list, skipped = _diff_operations('sample', attrs, current_df)
+    ops = {e['name']:{o['attributeName']:o['op'] for o in e['operations']} for e in attr_list}
+    assert ops == {
+        's1': {'id': 'AddUpdateAttribute'},
+        's2': {'id': 'AddUpdateAttribute', 'n': 'AddUpdateAttribute', 'flag': 'AddUpdateAttribute'},
+        's3': {'flag': 'RemoveAttribute'},
+    }
+    assert skipped.tolist() == [2, 0, 2]
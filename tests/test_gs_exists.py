@@ -0,0 +1,30 @@
+import os
+import numpy as np
+import pandas as pd
+import dalmatian.core as core
+
+
+def test_gs_exists_local_backend(tmp_path):
+    core.set_storage_backend(core.LocalBackend(str(tmp_path)))
+    try:
+        paths = []
+        for k in range(20):
+            d = tmp_path / 'bucket' / 'submission' / 'wf{}'.format(k)
+            d.mkdir(parents=True)
+            (d / 'out.txt').write_text('x')
+            paths += ['gs://bucket/submission/wf{}/out.txt'.format(k),
+                      'gs://bucket/submission/wf{}/missing.txt'.format(k)]
+        (tmp_path / 'bucket' / 'single.txt').write_text('x')
+        paths += ['gs://bucket/single.txt', 'gs://bucket/other/missing.txt', np.nan]
+        s = pd.Series(paths, index=['e{}'.format(k) for k in range(len(paths))])
+
+        expected = [isinstance(p, str) and os.path.isfile(os.path.join(str(tmp_path), p[5:])) for p in paths]
+        # grouped listing
+        r = core.gs_exists(s)
+        assert r.name=='file_exists'
+        assert r.tolist()==expected
+        # individual stat calls only
+        r = core.gs_exists(s, min_group_size=len(paths)+1)
+        assert r.tolist()==expected
+    finally:
+        core.set_storage_backend(None)
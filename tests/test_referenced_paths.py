@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+import dalmatian
+
+
+def test_referenced_paths_in_list_strings():
+    wm = dalmatian.WorkspaceManager('ns/ws')
+    entities = pd.DataFrame({
+        'bam': ['gs://bk/a/s1.bam', np.nan],
+        # list outputs written by update_entity_attributes are stored as str
+        'shards': ["['gs://bk/a/x', 'gs://bk/a0/q']", '["gs://bk/b/1", "gs://bk/b/2"]'],
+        'n': [1, 2],
+    }, index=['s1', 's2'])
+    wm.get_attributes = lambda: {'ref': 'gs://bk/ref.fa', 'list': ['gs://bk/l/1'],
+                                 'items': {'itemsType': 'AttributeValue', 'items': ['gs://bk/i/1']}}
+    wm.get_entity_types = lambda: ['sample']
+    wm.get_entities = lambda etype: entities
+    paths = wm.get_referenced_paths()
+    assert {'gs://bk/a/s1.bam', 'gs://bk/a/x', 'gs://bk/a0/q', 'gs://bk/b/1', 'gs://bk/b/2',
+            'gs://bk/ref.fa', 'gs://bk/l/1', 'gs://bk/i/1'} <= paths
+    assert all(p.startswith('gs://') for p in paths)
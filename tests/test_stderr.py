@@ -0,0 +1,53 @@
+import pandas as pd
+import dalmatian
+import dalmatian.core as core
+
+
+def test_gs_cat_local_backend(tmp_path):
+    core.set_storage_backend(core.LocalBackend(str(tmp_path)))
+    try:
+        (tmp_path / 'bucket').mkdir()
+        (tmp_path / 'bucket' / 'log.txt').write_bytes(b'0123456789')
+        assert core.gs_cat('gs://bucket/log.txt')=='0123456789'
+        assert core.gs_cat('gs://bucket/log.txt', tail_bytes=4)=='6789'
+        assert core.gs_cat('gs://bucket/log.txt', tail_bytes=100)=='0123456789'
+    finally:
+        core.set_storage_backend(None)
+
+
+def test_get_stderr(tmp_path):
+    core.set_storage_backend(core.LocalBackend(str(tmp_path)))
+    try:
+        d = tmp_path / 'bucket' / 'sub'
+        d.mkdir(parents=True)
+        for k in range(3):
+            (d / 'stderr{}'.format(k)).write_text('error {}\n'.format(k)*1000)
+
+        wm = dalmatian.WorkspaceManager('ns/ws')
+        def get_workflow_metadata(submission_id, workflow_id, include_keys=None):
+            if workflow_id=='w_missing_metadata':
+                raise KeyError(workflow_id)
+            return {'calls': {'wf.taskA': [{'stderr': 'gs://bucket/sub/{}_a'.format(workflow_id)}],
+                              'wf.taskB': [{'stderr': 'gs://bucket/sub/old'},
+                                           {'stderr': 'gs://bucket/sub/std{}'.format(workflow_id)}]}}
+        wm.get_workflow_metadata = get_workflow_metadata
+
+        state_df = pd.DataFrame({
+            'taskB': ['Failed', 'Done', 'Failed', 'Failed', 'Failed', 'Failed'],
+            'workflow_id': ['err0', 'err1', 'err2', 'err_missing', 'w_missing_metadata', 'err1'],
+            'submission_id': 's',
+        }, index=['e{}'.format(k) for k in range(6)])
+        stderr_df = wm.get_stderr(state_df, 'taskB', tail_kb=1)
+
+        assert stderr_df.shape==(5, 3)
+        assert stderr_df.columns.tolist()==['stderr_path', 'stderr', 'error']
+        assert stderr_df.index.tolist()==['e0', 'e2', 'e3', 'e4', 'e5']
+        assert stderr_df.loc['e0', 'stderr_path']=='gs://bucket/sub/stderr0'
+        assert stderr_df.loc['e0', 'stderr']==('error 0\n'*1000)[-1024:]
+        assert stderr_df.loc['e5', 'stderr']==('error 1\n'*1000)[-1024:]
+        assert stderr_df.loc[['e0', 'e2', 'e5'], 'error'].isnull().all()
+        assert stderr_df.loc['e3', 'error'].startswith('FileNotFoundError')
+        assert stderr_df.loc['e4', 'error'].startswith('KeyError')
+        assert stderr_df.loc[['e3', 'e4'], ['stderr_path', 'stderr']].isnull().all().all()
+    finally:
+        core.set_storage_backend(None)